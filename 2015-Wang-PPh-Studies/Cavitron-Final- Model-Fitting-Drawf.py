@@ -1,6 +1,11 @@
 import numpy
 from scipy.optimize import  leastsq
 
+from fit_monitor import fit_monitor
+
+# set MONITOR to True to save the residual evaluations of each fitting to csv
+MONITOR = False
+
 # Central PLC, basal end parameter, distal end parameter, bubble pressure and suraface tension
 NEWR = []
 OLDR = []
@@ -116,7 +121,8 @@ def drawf_PLC(ct,vl):
         site += dsite
 
 # main part
-def residual(p,plsqt,plsqk,plsqkmax):
+# give a fit_monitor to record the evaluations
+def residual(p,plsqt,plsqk,plsqkmax,monitor=None):
     global BP, center_PLC
     plsqbp,plsqplc = p
     BP = plsqbp
@@ -124,7 +130,6 @@ def residual(p,plsqt,plsqk,plsqkmax):
     #print BP, center_PLC
     tmpk = []
     for tension in plsqt:
-        print f,tension
         global NEWR, OLDR
         NEWR = []
         OLDR = []
@@ -132,7 +137,8 @@ def residual(p,plsqt,plsqk,plsqkmax):
         tempvalue = 275.0/sum(NEWR) * plsqkmax
         tmpk.append(tempvalue)
     results = plsqk - tmpk
-    print results/plsqk * 100
+    if monitor is not None:
+        monitor.record(p, results)
     return results
 
 
@@ -210,7 +216,13 @@ for i in range(len(filenames)):
         Sigk = numpy.array(kh25s)
         print Sigt
         print Sigk
-        plsq = leastsq(residual,p0,args=(Sigt,Sigk,tmpkmax))
+        if MONITOR:
+            monitor = fit_monitor(names=["BP","PLC"])
+        else:
+            monitor = None
+        plsq = leastsq(residual,p0,args=(Sigt,Sigk,tmpkmax,monitor))
+        if monitor is not None:
+            monitor.to_csv("./Fitting-Monitor." + str(i) + ".csv")
         print "The best fitting of [BP,PLC] and Kmax is"
         print plsq[0],tmpkmax
         plsq_results = residual(plsq[0],Sigt,Sigk,tmpkmax)
@@ -1,4 +1,7 @@
-from numpy import array,exp,sqrt
+from multiprocessing import Pool
+
+from numpy import array,column_stack,exp,maximum,mean,minimum,nan,sqrt,where
+from pandas import DataFrame
 from scipy.optimize import leastsq
 
 def GetPhotosyntheticJ(jmax, light):
@@ -32,68 +35,140 @@ def GetPhotosyntheticVcmax(vcmax25, tem):
     vcmax = vcmax25 * factor
     return vcmax
 
-def residual_vj(p,x,y,t):
+# temperature dependent terms of the A-Ci curve at 1200 PAR
+#     vmax and jmax are per unit v25 and j25, so that they are linear in both
+def get_aci_terms(t):
+    fv = GetPhotosyntheticVcmax(1.0,t)
+    fj = GetPhotosyntheticJmax(1.0,t)
+    kc = 41.01637 * 2.1**(0.1*(t-25.0))
+    ko = 28201.92 * 1.2**(0.1*(t-25.0))
+    km = kc * (1.0+21000.0/ko)
+    return fv,fj,km
+
+# derivative of j with respect to jmax, from 0.9*j^2 - (0.3*light+jmax)*j + 0.3*light*jmax = 0
+def get_djdjmax(jmax, j, light):
+    return (0.3*light - j) / (0.3*light + jmax - 1.8*j)
+
+def get_vj(p,x,t):
     v25,j25 = p
-    a_list = []
-    for i in range(len(x)):
-        vmax = GetPhotosyntheticVcmax(v25,t[i])
-        jmax = GetPhotosyntheticJmax(j25,t[i])
-        j = GetPhotosyntheticJ(jmax,1200.0)
-        kc = 41.01637 * 2.1**(0.1*(t[i]-25.0))
-        ko = 28201.92 * 1.2**(0.1*(t[i]-25.0))
-        gamma = 21000.0 * 0.5 / (2600.0*0.57**(0.1*(t[i]-25.0)))
-        km = kc * (1.0+21000.0/ko)
-        aj = j * (x[i]-gamma) / (4.0*(x[i]+2*gamma))
-        ac = vmax * (x[i]-gamma) / (x[i]+km)
-        if(x[i] < gamma):
-            aj = 0.0
-            ac = 0.0
-        rday = 1.95 * 2**(0.1*(t[i]-25.0)) / (1.0+exp(1.3*(t[i]-55.0)))
-        af = min(aj,ac)# - rday
-        a_list.append(af)
-    ym = array(a_list)
+    fv,fj,km = get_aci_terms(t)
+    gamma = 21000.0 * 0.5 / (2600.0*0.57**(0.1*(t-25.0)))
+    vmax = v25 * fv
+    jmax = j25 * fj
+    j = GetPhotosyntheticJ(jmax,1200.0)
+    aj = j * (x-gamma) / (4.0*(x+2*gamma))
+    ac = vmax * (x-gamma) / (x+km)
+    aj = where(x<gamma, 0.0, aj)
+    ac = where(x<gamma, 0.0, ac)
+    return aj,ac,j,jmax,fv,fj,km,gamma
+
+# residuals of the fitting, give a fit_monitor to record the evaluations
+def residual_vj(p,x,y,t,monitor=None):
+    aj,ac = get_vj(p,x,t)[:2]
+    ym = minimum(aj,ac)# - rday
     result = ym - y
-    for i in range(len(x)):
-        print(x[i], "\t", y[i], "\t", ym[i], "\t", t[i])
-    print("")
+    if monitor is not None:
+        monitor.record(p, result)
     return result
 
-def residual_vjgamma(p,x,y,t):
+# jacobian of residual_vj with respect to v25 and j25
+def jacobian_vj(p,x,y,t,monitor=None):
+    aj,ac,j,jmax,fv,fj,km,gamma = get_vj(p,x,t)
+    dac_dv = fv * (x-gamma) / (x+km)
+    daj_dj = get_djdjmax(jmax,j,1200.0) * fj * (x-gamma) / (4.0*(x+2*gamma))
+    use_j  = aj<=ac
+    below  = x<gamma
+    d_v = where(use_j|below, 0.0, dac_dv)
+    d_j = where(use_j&~below, daj_dj, 0.0)
+    return column_stack([d_v, d_j])
+
+def get_vjgamma(p,x,t):
     v25,j25,gamma = p
-    a_list = []
-    for i in range(len(x)):
-        vmax = GetPhotosyntheticVcmax(v25,t[i])
-        jmax = GetPhotosyntheticJmax(j25,t[i])
-        j = GetPhotosyntheticJ(jmax,1200.0)
-        kc = 41.01637 * 2.1**(0.1*(t[i]-25.0))
-        ko = 28201.92 * 1.2**(0.1*(t[i]-25.0))
-        #gamma = 21000.0 * 0.5 / (2600.0*0.57**(0.1*(t[i]-25.0)))
-        km = kc * (1.0+21000.0/ko)
-        aj = j * (x[i]-gamma) / (4.0*(x[i]+2*gamma))
-        ac = vmax * (x[i]-gamma) / (x[i]+km)
-        # 1.95 is the rday for water birch, change it accordingly
-        rday = 1.95 * 2**(0.1*(t[i]-25.0)) / (1.0+exp(1.3*(t[i]-55.0)))
-        af = max(0, min(aj,ac) ) - rday
-        #af = min(aj,ac)
-        a_list.append(af)
-    ym = array(a_list)
+    fv,fj,km = get_aci_terms(t)
+    vmax = v25 * fv
+    jmax = j25 * fj
+    j = GetPhotosyntheticJ(jmax,1200.0)
+    aj = j * (x-gamma) / (4.0*(x+2*gamma))
+    ac = vmax * (x-gamma) / (x+km)
+    # 1.95 is the rday for water birch, change it accordingly
+    rday = 1.95 * 2**(0.1*(t-25.0)) / (1.0+exp(1.3*(t-55.0)))
+    return aj,ac,rday,j,jmax,vmax,fv,fj,km
+
+def residual_vjgamma(p,x,y,t,monitor=None):
+    aj,ac,rday = get_vjgamma(p,x,t)[:3]
+    ym = maximum(0, minimum(aj,ac) ) - rday
+    #ym = minimum(aj,ac)
     result = ym - y
-    error = sum(result**2)
-    for i in range(len(x)):
-        print(x[i], "\t", y[i], "\t", ym[i], "\t", t[i])
-    print("\n", v25, "\t", j25, "\t", gamma, "\t", error)
-    print("")
+    if monitor is not None:
+        monitor.record(p, result)
     return result
 
-def aci_curve(x = range(10), y = range(10), t = range(10), rday=True):
-    xx = array(x)/10.0
-    yy = array(y)
-    tt = array(t)
+# jacobian of residual_vjgamma with respect to v25, j25 and gamma
+def jacobian_vjgamma(p,x,y,t,monitor=None):
+    gamma = p[2]
+    aj,ac,rday,j,jmax,vmax,fv,fj,km = get_vjgamma(p,x,t)
+    dac_dv = fv * (x-gamma) / (x+km)
+    daj_dj = get_djdjmax(jmax,j,1200.0) * fj * (x-gamma) / (4.0*(x+2*gamma))
+    dac_dg = -vmax / (x+km)
+    daj_dg = -0.75 * j * x / (x+2*gamma)**2
+    use_j  = aj<=ac
+    active = minimum(aj,ac)>0
+    d_v = where(active&~use_j, dac_dv, 0.0)
+    d_j = where(active& use_j, daj_dj, 0.0)
+    d_g = where(active, where(use_j, daj_dg, dac_dg), 0.0)
+    return column_stack([d_v, d_j, d_g])
+
+# fit one curve, v25 and j25 (and gamma if not rday), with the convergence
+#     diagnostics
+def fit_aci_curve(x, y, t, rday=True, monitor=None):
+    xx = array(x, dtype=float)/10.0
+    yy = array(y, dtype=float)
+    tt = array(t, dtype=float)
     if(rday == True):
         p0 = [50.0,100.0]
-        plsq = leastsq(residual_vj, p0, args=(xx,yy,tt))
-        return [plsq[0][0], plsq[0][1]]
+        plsq = leastsq(residual_vj, p0, args=(xx,yy,tt,monitor), Dfun=jacobian_vj, full_output=1)
+        gamma = nan
     else:
         p0 = [50.0,80.0,6.0]
-        plsq = leastsq(residual_vjgamma, p0, args=(xx,yy,tt))
-        return [plsq[0][0], plsq[0][1], plsq[0][2]]
+        plsq = leastsq(residual_vjgamma, p0, args=(xx,yy,tt,monitor), Dfun=jacobian_vjgamma, full_output=1)
+        gamma = plsq[0][2]
+    p,cov,info,mesg,ier = plsq
+    return {"V25"      : p[0],
+            "J25"      : p[1],
+            "Gamma"    : gamma,
+            "RMSE"     : sqrt(mean(info["fvec"]**2)),
+            "N"        : len(xx),
+            "NFev"     : info["nfev"],
+            "Converged": ier in (1,2,3,4),
+            "Message"  : mesg}
+
+# v25 and j25 (and gamma if not rday) of fit_aci_curve
+def aci_curve(x = range(10), y = range(10), t = range(10), rday=True, monitor=None):
+    fit = fit_aci_curve(x, y, t, rday, monitor)
+    if(rday == True):
+        return [fit["V25"], fit["J25"]]
+    else:
+        return [fit["V25"], fit["J25"], fit["Gamma"]]
+
+# worker of aci_curve_table, task is (curve id, ci, a, t, rday)
+def fit_aci_task(task):
+    curve,x,y,t,rday = task
+    result = {"Curve": curve}
+    result.update( fit_aci_curve(x, y, t, rday) )
+    return result
+
+# fit every curve in a long-format table, one row per point
+#     the curves are fitted in parallel by a process pool, and the results are
+#     sorted by the curve id whatever the order the workers finish in
+def aci_curve_table(data, curve="Curve", ci="Ci", a="A", t="T", rday=True, processes=None, chunksize=8):
+    tasks = []
+    for name,sub in data.groupby(curve, sort=True):
+        tasks.append( (name, sub[ci].values, sub[a].values, sub[t].values, rday) )
+    if processes==1 or len(tasks)<2:
+        results = list(map(fit_aci_task, tasks))
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(fit_aci_task, tasks, chunksize)
+    table = DataFrame(results)
+    table = table.rename(columns={"Curve": curve})
+    return table
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from time import time
+
+from numpy import asarray,sqrt
+
+# collector of the residual evaluations during a fitting
+#     the residual functions call record() once per evaluation when they are
+#     given a monitor, and skip it with a single check when the monitor is None
+#     callback, if given, is called with every new row
+class fit_monitor():
+    def __init__(self, names=None, callback=None):
+        self.names    = names
+        self.callback = callback
+        self.reset()
+    
+    def reset(self):
+        self.start = time()
+        self.count = 0
+        self.rows  = []
+    
+    # row is [evaluation, elapsed time in s, residual norm, parameters...]
+    def record(self, p, residual):
+        self.count += 1
+        norm = float( sqrt((asarray(residual, dtype=float)**2).sum()) )
+        row  = [self.count, time()-self.start, norm] + [float(x) for x in p]
+        self.rows.append(row)
+        if self.callback is not None:
+            self.callback(row)
+    
+    def get_header(self):
+        n_par = len(self.rows[0]) - 3 if self.rows else 0
+        if self.names is None:
+            names = ["p%d" % i for i in range(n_par)]
+        else:
+            names = list(self.names)
+        return ["Evaluation", "Time", "Norm"] + names
+    
+    def to_csv(self, filename):
+        f = open(filename, "w")
+        f.write(",".join(self.get_header()) + "\n")
+        for row in self.rows:
+            f.write("%d," % row[0] + ",".join(["%.10g" % x for x in row[1:]]) + "\n")
+        f.close()
@@ -5,10 +5,16 @@ Created on Thu Aug 30 11:52:13 2018
 @author: Yujie Wang
 """
 
-from numpy  import exp
-from pandas import read_csv
+from multiprocessing import Pool
 
-def get_optimal_kmax(list_ppd, list_pmd, list_emd):
+from numpy  import argmin,asarray,exp,linspace,log,maximum
+from pandas import DataFrame,read_csv
+from scipy.optimize import minimize_scalar
+
+# midday leaf water potential of every observation at kmax, from the predawn
+#     ppd and the flow emd through 50 root, 50 stem and 50 leaf layers
+#     the observations are stepped through the layers together, as arrays
+def get_pmd_array(kmax, list_ppd, list_emd):
     # assign the VCs
     root_b = 1.879
     root_c = 2.396
@@ -16,6 +22,30 @@ def get_optimal_kmax(list_ppd, list_pmd, list_emd):
     stem_c = 9.380
     leaf_b = 1.897
     leaf_c = 2.203
+    root_kmax = kmax * 1.863013458
+    stem_kmax = kmax * 4.11942096
+    leaf_kmax = kmax * 4.535504046
+    emd = asarray(list_emd, dtype=float)
+    tmp = asarray(list_ppd, dtype=float) + 0.0
+    for j in range(50):
+        k = maximum(1E-12, exp(-(tmp/root_b)**root_c) * root_kmax * 50.0)
+        tmp += emd / k
+    for j in range(50):
+        k = maximum(1E-12, exp(-(tmp/stem_b)**stem_c) * stem_kmax * 50.0)
+        tmp += emd / k
+    for j in range(50):
+        k = maximum(1E-12, exp(-(tmp/leaf_b)**leaf_c) * leaf_kmax * 50.0)
+        tmp += emd / k
+    return tmp
+
+# sum of squared misfits of the modeled to the observed midday water potentials
+def get_misfit(kmax, list_ppd, list_pmd, list_emd):
+    tmp = get_pmd_array(kmax, list_ppd, list_emd)
+    return ((tmp-asarray(list_pmd, dtype=float))**2.0).sum()
+
+# kmax of a tree from arrays of its predawn and midday water potentials and
+#     flows, by bisection on the sign of the misfit change from kmax to kmax+0.1
+def get_optimal_kmax(list_ppd, list_pmd, list_emd):
     # define the kmax to optimize
     maxk = 1E6
     mink = 1E-9
@@ -23,45 +53,9 @@ def get_optimal_kmax(list_ppd, list_pmd, list_emd):
         if maxk-mink<0.2:
             break
         kmax = 0.5 * (maxk+mink)
-        root_kmax = kmax * 1.863013458
-        stem_kmax = kmax * 4.11942096
-        leaf_kmax = kmax * 4.535504046
-        diff_p    = 0.0
-        for i in range(len(list_ppd)):
-            ppd = list_ppd[i]
-            pmd = list_pmd[i]
-            emd = list_emd[i]
-            tmp = ppd
-            for j in range(50):
-                k = max(1E-12, exp(-(tmp/root_b)**root_c) * root_kmax * 50.0)
-                tmp += emd / k
-            for j in range(50):
-                k = max(1E-12, exp(-(tmp/stem_b)**stem_c) * stem_kmax * 50.0)
-                tmp += emd / k
-            for j in range(50):
-                k = max(1E-12, exp(-(tmp/leaf_b)**leaf_c) * leaf_kmax * 50.0)
-                tmp += emd / k
-            diff_p += (tmp-pmd)**2.0
+        diff_p   = get_misfit(kmax, list_ppd, list_pmd, list_emd)
         kmax += 0.1
-        root_kmax = kmax * 1.863013458
-        stem_kmax = kmax * 4.11942096
-        leaf_kmax = kmax * 4.535504046
-        diff_pdk  = 0.0
-        for i in range(len(list_ppd)):
-            ppd = list_ppd[i]
-            pmd = list_pmd[i]
-            emd = list_emd[i]
-            tmp = ppd
-            for j in range(50):
-                k = max(1E-12, exp(-(tmp/root_b)**root_c) * root_kmax * 50.0)
-                tmp += emd / k
-            for j in range(50):
-                k = max(1E-12, exp(-(tmp/stem_b)**stem_c) * stem_kmax * 50.0)
-                tmp += emd / k
-            for j in range(50):
-                k = max(1E-12, exp(-(tmp/leaf_b)**leaf_c) * leaf_kmax * 50.0)
-                tmp += emd / k
-            diff_pdk += (tmp-pmd)**2.0
+        diff_pdk = get_misfit(kmax, list_ppd, list_pmd, list_emd)
         #print(diff_p, "\t", diff_pdk, "\t", kmax)
         if diff_pdk-diff_p>0:
             maxk = kmax-0.1
@@ -69,14 +63,59 @@ def get_optimal_kmax(list_ppd, list_pmd, list_emd):
             mink = kmax-0.1
     return kmax
 
-data = read_csv("ppe.txt", delimiter="\t")
+# kmax of a tree that minimizes the misfit, by brent's method on log(kmax)
+#     log(kmax) is first scanned at n_scan points from kmin to kmax, as the
+#     misfit is flat where the layers cavitate, and brent's method then
+#     searches the two intervals next to the best point to a tolerance of tol
+#     in log(kmax), i.e. a relative tolerance in kmax
+#     returns kmax, the misfit at it, and the iterations of brent's method
+def fit_kmax(list_ppd, list_pmd, list_emd, tol=1E-6, kmin=1E-9, kmax=1E6, n_scan=16):
+    list_ppd  = asarray(list_ppd, dtype=float)
+    list_pmd  = asarray(list_pmd, dtype=float)
+    list_emd  = asarray(list_emd, dtype=float)
+    def loss(x):
+        return get_misfit(exp(x), list_ppd, list_pmd, list_emd)
+    list_x    = linspace(log(kmin), log(kmax), n_scan)
+    list_loss = [loss(x) for x in list_x]
+    opt_site  = int(argmin(list_loss))
+    x_min     = list_x[max(opt_site-1, 0)]
+    x_max     = list_x[min(opt_site+1, n_scan-1)]
+    result    = minimize_scalar(loss,
+                                bounds=(x_min,x_max),
+                                method="bounded",
+                                options={"xatol": tol})
+    if result.fun < list_loss[opt_site]:
+        return exp(result.x), result.fun, result.nit
+    return exp(list_x[opt_site]), list_loss[opt_site], result.nit
+
+# worker of kmax_table, task is (tree id, ppd, pmd, emd, tol)
+def fit_kmax_task(task):
+    tree,list_ppd,list_pmd,list_emd,tol = task
+    kmax,misfit,nit = fit_kmax(list_ppd, list_pmd, list_emd, tol)
+    return {"TreeNo": tree,
+            "Kmax"  : kmax,
+            "Misfit": misfit,
+            "NIter" : nit}
+
+# fit the kmax of every tree in a long-format table, one row per observation
+#     the trees are fitted in parallel by a process pool, and the results are
+#     sorted by the tree id whatever the order the workers finish in
+def kmax_table(data, tree="TreeNo", ppd="Ppd", pmd="Pmd", emd="Etree", tol=1E-6, processes=None, chunksize=1):
+    tasks = []
+    for name,sub in data.groupby(tree, sort=True):
+        tasks.append( (name, sub[ppd].values, sub[pmd].values, sub[emd].values, tol) )
+    if processes==1 or len(tasks)<2:
+        results = list(map(fit_kmax_task, tasks))
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(fit_kmax_task, tasks, chunksize)
+    table = DataFrame(results)
+    table = table.rename(columns={"TreeNo": tree})
+    return table
+
+
+
 
-for no in range(1,11):
-    # read the data subset
-    data_sub = data.query("TreeNo==%d" % no)
-    # interate through the subset
-    list_ppd = data_sub["Ppd"  ].values
-    list_pmd = data_sub["Pmd"  ].values
-    list_emd = data_sub["Etree"].values
-    kmax = get_optimal_kmax(list_ppd, list_pmd, list_emd)
-    print("%d\t%.3f" % (no,kmax))
\ No newline at end of file
+if __name__ == "__main__":
+    data = read_csv("ppe.txt", delimiter="\t")
+    print(kmax_table(data))
@@ -75,10 +75,8 @@ def get_bbl_prediction(p, vm, jm, ca, d, ps, tem):
             ci_max = ci
     return a,gs
 
-# define the residual function
-def residual_bbl(p, data_tmp):
-    print(p)
-    print("\n")
+# define the residual function, give a fit_monitor to record the evaluations
+def residual_bbl(p, data_tmp, monitor=None):
     list_d   = data_tmp["D"   ].values
     list_a   = data_tmp["A"   ].values
     list_ca  = data_tmp["Ca"  ].values
@@ -103,7 +101,10 @@ def residual_bbl(p, data_tmp):
         residual.append( sqrt( abs(list_e[i]-e)/std_e ) )
         if list_pl[i]>0:
             residual.append( sqrt( abs(list_pl[i]-pl)/std_p ) )
-    return array(residual)
+    residual = array(residual)
+    if monitor is not None:
+        monitor.record(p, residual)
+    return residual
 
 def pred_bbl(p, data_tmp):
     list_d   = data_tmp["D"   ].values
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the photosynthesis functions and the gain_risk models
+
+    python benchmark.py --output bench.json
+    python benchmark.py --output new.json --baseline bench.json --threshold 0.2
+
+The drivers come from a fixed seed, so that two runs time the same calls.
+With a baseline, the script exits with 1 if any kernel is slower than the
+baseline calls/sec by more than the threshold fraction.
+"""
+
+from argparse import ArgumentParser
+from json     import dump,load
+from platform import platform,python_version
+from sys      import exit
+from time     import perf_counter
+import tracemalloc
+
+from numpy import random
+
+from gain_risk_model_aspen import gain_risk_model_aspen
+from gain_risk_model_birch import gain_risk_model_birch
+from gain_risk_model_other import gain_risk_model_other
+from jit_kernels           import JIT_ENABLED
+from photosynthesis        import GetOnePointVcmax,clear_leaf_cache,get_a_ci,get_a_ci_seg,get_gamma_nostar
+
+SEED = 20201018
+
+LIST_OPTIMA = ["dewar", "dewar_mod", "eller", "lambda", "prentice", "sperry", "wang", "wap"]
+
+
+
+
+# reproducible drivers, n of each
+def get_drivers(n, seed=SEED):
+    rng = random.default_rng(seed)
+    return {"v25"   : rng.uniform( 30.0, 100.0, n),
+            "j25"   : rng.uniform( 60.0, 200.0, n),
+            "gc"    : rng.uniform(  0.0,   3.0, n),
+            "ca"    : rng.uniform( 20.0,  80.0, n),
+            "tem"   : rng.uniform( 10.0,  35.0, n),
+            "par"   : rng.uniform(100.0,2000.0, n),
+            "ci"    : rng.uniform( 10.0,  40.0, n),
+            "an"    : rng.uniform(  2.0,  20.0, n),
+            "e"     : rng.uniform(  0.0, 800.0, n),
+            "d_leaf": rng.uniform(  0.5,   3.0, n)}
+
+# list of (name, function, list of argument tuples)
+#     n_fast calls for the photosynthesis and hydraulic kernels,
+#     n_slow calls for each optimizer
+def get_cases(n_fast=2000, n_slow=5, seed=SEED):
+    dr = get_drivers(n_fast, seed)
+    cases = []
+    cases.append( ("get_a_ci",
+                   get_a_ci,
+                   [(dr["v25"][i], dr["j25"][i], 2.5, dr["gc"][i], dr["ca"][i], dr["tem"][i], dr["par"][i]) for i in range(n_fast)]) )
+    cases.append( ("get_a_ci_seg",
+                   get_a_ci_seg,
+                   [(dr["v25"][i], dr["j25"][i], 2.5, dr["gc"][i], dr["ca"][i], dr["tem"][i], dr["par"][i]) for i in range(n_fast)]) )
+    cases.append( ("get_gamma_nostar",
+                   get_gamma_nostar,
+                   [(dr["v25"][i], 2.5, dr["tem"][i], dr["par"][i]) for i in range(n_fast)]) )
+    cases.append( ("GetOnePointVcmax",
+                   GetOnePointVcmax,
+                   [(dr["ci"][i], dr["an"][i], dr["tem"][i]) for i in range(n_fast)]) )
+    aspen = gain_risk_model_aspen()
+    cases.append( ("aspen.get_p_leaf",
+                   aspen.get_p_leaf,
+                   [(dr["e"][i],) for i in range(n_fast)]) )
+    cases.append( ("aspen.solve_e_crit",
+                   aspen.solve_e_crit,
+                   [() for i in range(n_slow)]) )
+    models = {"aspen": gain_risk_model_aspen(),
+              "birch": gain_risk_model_birch(),
+              "other": gain_risk_model_other()}
+    for key in models:
+        for opt in LIST_OPTIMA:
+            if not hasattr(models[key], "get_optima_"+opt):
+                continue
+            cases.append( ("%s.get_optima_%s" % (key,opt),
+                           getattr(models[key], "get_optima_"+opt),
+                           [{"d_leaf": dr["d_leaf"][i],
+                             "ca"    : dr["ca"    ][i],
+                             "t_leaf": dr["tem"   ][i],
+                             "par"   : dr["par"   ][i]} for i in range(n_slow)]) )
+    return cases
+
+def run_once(func, list_args):
+    for args in list_args:
+        if isinstance(args, dict):
+            func(**args)
+        else:
+            func(*args)
+
+# clear the leaf cache, and the e_crit and supply curve of the model that
+#     func is a method of, so that each run solves them again
+def clear_caches(func):
+    clear_leaf_cache()
+    model = getattr(func, "__self__", None)
+    if hasattr(model, "clear_supply_cache"):
+        model.clear_supply_cache()
+
+# best calls/sec of repeat runs, and the memory allocated over one run
+def time_case(func, list_args, repeat=3):
+    # warm up the JIT so that the first run is not timed
+    run_once(func, list_args[:1])
+    best = float("inf")
+    for i in range(repeat):
+        clear_caches(func)
+        start = perf_counter()
+        run_once(func, list_args)
+        best  = min(best, perf_counter()-start)
+    clear_caches(func)
+    tracemalloc.start()
+    run_once(func, list_args)
+    current,peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"calls"        : len(list_args),
+            "seconds"      : best,
+            "calls_per_sec": len(list_args) / best,
+            "alloc_peak_kb": peak / 1024.0,
+            "alloc_net_kb" : current / 1024.0}
+
+def run_benchmarks(n_fast=2000, n_slow=5, repeat=3, only=None, seed=SEED):
+    results = {}
+    for name,func,list_args in get_cases(n_fast, n_slow, seed):
+        if only is not None and only not in name:
+            continue
+        results[name] = time_case(func, list_args, repeat)
+        print("%-28s %12.1f calls/s %10.1f kB peak" % (name, results[name]["calls_per_sec"], results[name]["alloc_peak_kb"]))
+    return {"meta"   : {"seed"     : seed,
+                        "n_fast"   : n_fast,
+                        "n_slow"   : n_slow,
+                        "repeat"   : repeat,
+                        "jit"      : JIT_ENABLED,
+                        "python"   : python_version(),
+                        "platform" : platform()},
+            "results": results}
+
+# kernels that are slower than the baseline by more than threshold
+def get_regressions(bench, baseline, threshold=0.2):
+    regressions = []
+    for name in bench["results"]:
+        if name not in baseline["results"]:
+            continue
+        new = bench   ["results"][name]["calls_per_sec"]
+        old = baseline["results"][name]["calls_per_sec"]
+        if new < old * (1.0-threshold):
+            regressions.append( (name, old, new) )
+    return regressions
+
+
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="benchmark the photosynthesis and gain_risk kernels")
+    parser.add_argument("--output"   , default="benchmark.json", help="json file to save the results to")
+    parser.add_argument("--baseline" , default=None , help="json file of an earlier run to compare with")
+    parser.add_argument("--threshold", default=0.2  , type=float, help="allowed fractional loss of calls/sec")
+    parser.add_argument("--n-fast"   , default=2000 , type=int  , help="calls per photosynthesis or hydraulic kernel")
+    parser.add_argument("--n-slow"   , default=5    , type=int  , help="calls per optimizer")
+    parser.add_argument("--repeat"   , default=3    , type=int  , help="timed runs per kernel, the best is kept")
+    parser.add_argument("--only"     , default=None , help="run only the kernels whose name contains this")
+    args  = parser.parse_args()
+    bench = run_benchmarks(args.n_fast, args.n_slow, args.repeat, args.only)
+    with open(args.output, "w") as f:
+        dump(bench, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = load(f)
+        regressions = get_regressions(bench, baseline, args.threshold)
+        for name,old,new in regressions:
+            print("REGRESSION %-28s %12.1f -> %12.1f calls/s" % (name, old, new))
+        if regressions:
+            exit(1)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from numpy  import maximum
+from pandas import DataFrame
+
+from optima_series import get_driver_arrays
+
+
+
+
+# soil water content after e (per basal area) for dt hours, and the p_soil of
+#     the campbell curve at it; the water comes from a soil layer of depth
+#     soil_depth (m) under the crown area gaba of each unit basal area
+def update_soil(model, e, dt, soil_depth):
+    c_curr = model.c_curr - e * dt / 998.0 / model.gaba / soil_depth
+    c_curr = max(c_curr, 1E-6)
+    model.c_curr = c_curr
+    model.p_soil = model.p_ssat * (c_curr/model.c_ssat) ** (-model.b_ssat)
+
+# legacy of each weibull layer, the most negative pressure it has been at
+def update_legacy(model, e):
+    for name,profile in model.get_p_profile(e).items():
+        legacy = getattr(model, "l_"+name)
+        if len(legacy)>0:
+            setattr(model, "l_"+name, maximum(legacy, profile))
+
+# step the model through a forcing series and solve the optimum of criterion
+#     at each step, then draw the soil water and update the legacy with it
+#     forcing is a DataFrame or a dict with d_leaf, ca, t_leaf and par columns,
+#     dt is the step in hours, and kwargs go to the get_optima_* method
+#     the stomata are closed at night, when par is 0, and the step returns what
+#     get_optima_* returns at e = 0
+#     the model is changed in place, e.g. c_curr, p_soil and the legacy
+#     with warm_start, e_crit and the optimum of each step start from those of
+#     the last step, so that a step costs about one optimizer solve; an
+#     e_guess in kwargs is the guess of the first step, and is dropped without
+#     warm_start
+def simulate_drought(model, forcing, criterion="wang", dt=0.5, soil_depth=1.0, legacy=True, warm_start=True, **kwargs):
+    if "rhiz" not in model.segments:
+        raise ValueError("the drought simulator needs a model with a rhizosphere segment")
+    forcing = get_driver_arrays(forcing)
+    func    = getattr(model, "get_optima_"+criterion)
+    e_crit  = None
+    e_flow  = kwargs.pop("e_guess", None)
+    results = []
+    for i in range(len(forcing["par"])):
+        if warm_start:
+            e_crit = model.get_e_crit(e_crit)
+        else:
+            e_crit = model.get_e_crit()
+        if warm_start and criterion!="sperry" and e_flow is not None:
+            kwargs["e_guess"] = min(e_flow, e_crit)
+        else:
+            kwargs.pop("e_guess", None)
+        if forcing["par"][i]>0:
+            a_opt,e_opt,p_opt = func(d_leaf=forcing["d_leaf"][i],
+                                     ca=forcing["ca"][i],
+                                     t_leaf=forcing["t_leaf"][i],
+                                     par=forcing["par"][i],
+                                     **kwargs)
+            e_flow = e_opt
+        else:
+            a_opt,e_opt,p_opt = model.get_optima_values(criterion, 0.0,
+                                                        forcing["d_leaf"][i],
+                                                        forcing["ca"][i],
+                                                        forcing["t_leaf"][i],
+                                                        forcing["par"][i])
+            e_flow = 0.0
+        results.append( {"a_opt" : a_opt,
+                         "e_opt" : e_opt,
+                         "p_opt" : p_opt,
+                         "e_crit": e_crit,
+                         "p_soil": model.p_soil,
+                         "c_curr": model.c_curr} )
+        if legacy:
+            update_legacy(model, e_flow)
+        update_soil(model, e_flow, dt, soil_depth)
+    return DataFrame(results)
+
+
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+    from numpy import arange,clip,pi,sin
+    from gain_risk_model_aspen import gain_risk_model_aspen
+
+    # 60 days of half-hours, a sine for par and t_leaf
+    hour    = arange(0, 60*24, 0.5)
+    day     = sin((hour%24-6.0)/12.0*pi)
+    forcing = {"par"   : clip(2000.0*day, 0.0, None),
+               "t_leaf": 22.0 + 8.0*day,
+               "d_leaf": clip(2.0*day, 0.1, None)}
+    for warm_start in [False, True]:
+        model = gain_risk_model_aspen()
+        start = perf_counter()
+        table = simulate_drought(model, forcing, "wang", warm_start=warm_start)
+        print("warm_start=%s: %.2f s" % (warm_start, perf_counter()-start))
+        print(table.iloc[24::960])
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+
+from numpy import abs as absolute,arange,asarray,errstate,full,inf,isfinite,log,maximum,where,zeros
+
+from gain_risk_model import N_SPERRY,PRESETS,SOIL_ATTRS,gain_risk_model,get_sperry_site,marginal_optima
+from hydraulics      import p_layers_array,p_layers_deriv_array,p_layers_profile_array,p_rhiz_array,p_rhiz_deriv_array,supply_curve_cache
+from photosynthesis  import get_a_ci_array,get_a_ci_seg_deriv_array
+
+
+
+
+# n_tree gain-risk trees of one preset solved together
+#     every trait is an array of n_tree values, and the legacy l_X of a weibull
+#     segment X is an (n_tree, n_layer) array; traits given as keywords replace
+#     those of the preset, and are broadcast to n_tree
+#     the hydraulics are the array functions of hydraulics.py with the traits as
+#     arrays, so that one pass solves p_leaf of all the trees, and e_crit and the
+#     optima are solved by vectorized newton and regula falsi iterations
+#     the trait arrays may be changed in place, e.g. ensemble.k_stem[3] = 1E3,
+#     the cached e_crit compares them with a copy like the legacy of the models
+class gain_risk_ensemble(supply_curve_cache, marginal_optima):
+    def __init__(self, preset="aspen", n_tree=1, segments=None, n_shell=10, n_layer=20, **traits):
+        setting  = PRESETS[preset]
+        segments = tuple(setting["segments"] if segments is None else segments)
+        object.__setattr__(self, "SUPPLY_ATTRS", ())
+        self.preset   = preset
+        self.n_tree   = n_tree
+        self.segments = segments
+        self.n_shell  = n_shell
+        self.n_layer  = n_layer
+        self.output_g = setting["output_g"]
+        for key,value in dict(setting["traits"], **traits).items():
+            setattr(self, key, full(n_tree, value, dtype=float))
+        # legacy, the pressure history of each layer of each tree
+        for name in self.get_xylem():
+            if setting["has_legacy"]:
+                setattr(self, "l_"+name, zeros((n_tree, self.get_n_layer(name))))
+            else:
+                setattr(self, "l_"+name, zeros((n_tree, 0)))
+        # attributes that the supply curve depends on, the arrays among them
+        #     are also compared with a copy
+        arrays = []
+        if "rhiz" in segments:
+            arrays += list(SOIL_ATTRS)
+        else:
+            arrays += ["p_soil"]
+        for name in self.get_xylem():
+            arrays += [x+"_"+name for x in ("k","b","c","h","l")]
+        object.__setattr__(self, "SUPPLY_ATTRS", tuple(["segments", "n_shell", "n_layer"] + arrays))
+        object.__setattr__(self, "LEGACY_ATTRS", tuple(arrays))
+        self.clear_supply_cache()
+
+    # the weibull segments
+    def get_xylem(self):
+        return [name for name in self.segments if name!="rhiz"]
+
+    def get_n_layer(self, name):
+        if isinstance(self.n_layer, dict):
+            return self.n_layer[name]
+        return self.n_layer
+
+    # tree i as a gain_risk_model, e.g. to check it against the ensemble
+    def get_tree(self, i):
+        tree = gain_risk_model(self.preset, self.segments, self.n_shell, self.n_layer)
+        for key in PRESETS[self.preset]["traits"]:
+            setattr(tree, key, float(getattr(self, key)[i]))
+        for name in self.get_xylem():
+            setattr(tree, "l_"+name, getattr(self, "l_"+name)[i].copy())
+        tree.output_g = self.output_g
+        return tree
+
+    # p_crit of the last segment of each tree
+    def get_p_crit(self):
+        name = self.segments[-1]
+        b    = getattr(self, "b_"+name)
+        c    = getattr(self, "c_"+name)
+        return b * log(1000.0) ** (1.0/c)
+
+    # g (gc*10) at flow e, e has the trees on its last axis
+    def get_g(self, e, d_leaf):
+        f   = e * 0.0154321
+        gh  = f / self.laba / d_leaf * 100.0
+        gc  = gh / 1.6 / (1.0 + self.c_cons * gh**self.c_pows)
+        return gc * 10.0
+
+    def get_g_deriv(self, e, d_leaf):
+        f   = e * 0.0154321
+        gh  = f / self.laba / d_leaf * 100.0
+        dgh = 0.0154321 / self.laba / d_leaf * 100.0
+        den = 1.0 + self.c_cons * gh**self.c_pows
+        gc  = gh / 1.6 / den
+        dgc = dgh / 1.6 * (1.0 + self.c_cons * (1.0-self.c_pows) * gh**self.c_pows) / den**2
+        return gc * 10.0, dgc * 10.0
+
+    def get_output(self, a_opt, e_opt, p_opt, d_leaf):
+        if self.output_g:
+            return a_opt, self.get_g(e_opt,d_leaf)*1.6, p_opt
+        return a_opt, e_opt, p_opt
+
+    # p_leaf of each tree at flow, flow has the trees on its last axis, e.g. an
+    #     (n_tree,) array or an (n_e, n_tree) grid
+    def get_p_leaf(self, flow):
+        tension = self.p_soil
+        for name in self.segments:
+            if name=="rhiz":
+                tension = p_rhiz_array(flow,
+                                       tension,
+                                       self.p_ssat,
+                                       self.c_ssat,
+                                       self.b_ssat,
+                                       self.k_rhiz,
+                                       self.n_shell)
+            else:
+                tension = p_layers_array(flow,
+                                         tension,
+                                         getattr(self, "l_"+name).T,
+                                         getattr(self, "b_"+name),
+                                         getattr(self, "c_"+name),
+                                         getattr(self, "k_"+name),
+                                         getattr(self, "h_"+name),
+                                         self.get_n_layer(name))
+        return tension
+
+    # p_leaf and its first and second derivatives with flow
+    #     array_form is that of gain_risk_model, flow is always an array here
+    def get_p_leaf_deriv(self, flow, array_form=True):
+        tension   = self.p_soil
+        dtension  = 0.0
+        d2tension = 0.0
+        for name in self.segments:
+            if name=="rhiz":
+                tension,dtension,d2tension = p_rhiz_deriv_array(flow,
+                                                                tension,
+                                                                self.p_ssat,
+                                                                self.c_ssat,
+                                                                self.b_ssat,
+                                                                self.k_rhiz,
+                                                                self.n_shell)
+            else:
+                tension,dtension,d2tension = p_layers_deriv_array(flow,
+                                                                  tension,
+                                                                  dtension,
+                                                                  d2tension,
+                                                                  getattr(self, "l_"+name).T,
+                                                                  getattr(self, "b_"+name),
+                                                                  getattr(self, "c_"+name),
+                                                                  getattr(self, "k_"+name),
+                                                                  getattr(self, "h_"+name),
+                                                                  self.get_n_layer(name))
+        return tension, dtension, d2tension
+
+    # whole plant conductance k = de/dp and dk/de of each tree at flow
+    def get_k_leaf(self, flow):
+        p,dp,d2p = self.get_p_leaf_deriv(flow)
+        return 1.0/dp, -d2p/dp**2
+
+    # e_crit of every tree, cached by get_e_crit until the traits change
+    #     newton steps from e_guess (or 100), doubled until p_crit is passed and
+    #     kept inside the bracket of each tree, with a bisection instead where a
+    #     step leaves the bracket or does not halve the last one, as p rises
+    #     steeply near p_crit; the tolerances are those of
+    #     gain_risk_model.solve_e_crit
+    def solve_e_crit(self, e_guess=None):
+        p_crit = self.get_p_crit()
+        e_min  = zeros(self.n_tree)
+        e_max  = full(self.n_tree, inf)
+        if e_guess is None:
+            e = full(self.n_tree, 100.0)
+        else:
+            e = maximum(asarray(e_guess, dtype=float), 1E-3) + zeros(self.n_tree)
+        step = full(self.n_tree, inf)
+        done = zeros(self.n_tree, dtype=bool)
+        for i in range(200):
+            p,dp,d2p = self.get_p_leaf_deriv(e)
+            done  = done | (absolute(p-p_crit)<1E-3) | ((e_max-e_min)<1E-3)
+            if done.all():
+                break
+            upper = p>p_crit
+            e_max = where(upper, e, e_max)
+            e_min = where(upper, e_min, e)
+            with errstate(divide="ignore", invalid="ignore"):
+                e_new = e - (p-p_crit) / dp
+            bound = isfinite(e_max)
+            e_new = where(~bound & ~(e_new>e_min), 2.0*e_min, e_new)
+            slow  = bound & ~((e_new>e_min) & (e_new<e_max) & (2.0*absolute(e_new-e)<step))
+            e_new = where(slow, 0.5*(e_min+e_max), e_new)
+            step  = where(bound, absolute(e_new-e), step)
+            e     = where(done, e, e_new)
+        return e
+
+    # segmented a and da/de of each tree at flow e
+    def get_a_deriv(self, e, d_leaf, ca, t_leaf, par):
+        g,dg   = self.get_g_deriv(e, d_leaf)
+        c,a,da = get_a_ci_seg_deriv_array(self.vmax, self.jmax, 2.5, g, ca, t_leaf, par)
+        return a, da*dg
+
+    # e of each tree where func(e) crosses zero from above in [0, e_crit], by
+    #     the illinois variant of regula falsi to a tolerance of rtol*e_crit
+    #     the trees where func does not change sign get 0 or e_crit, as in
+    #     gain_risk_model.solve_optima
+    def solve_optima(self, func, e_crit, rtol):
+        e_min = zeros(self.n_tree)
+        e_max = e_crit + 0.0
+        f_min = func(e_min)
+        f_max = func(e_max)
+        e_opt = where(f_min<=0, 0.0, e_crit)
+        root  = (f_min>0) & (f_max<0)
+        done  = ~root
+        side  = zeros(self.n_tree)
+        for i in range(100):
+            if done.all():
+                break
+            with errstate(divide="ignore", invalid="ignore"):
+                e = where(done, e_opt, (e_min*f_max - e_max*f_min) / (f_max - f_min))
+            f = func(e)
+            lower = f>0
+            # the end that stays twice has its value halved
+            f_min = where(~lower & (side<0), 0.5*f_min, f_min)
+            f_max = where( lower & (side>0), 0.5*f_max, f_max)
+            e_min = where(lower, e, e_min)
+            f_min = where(lower, f, f_min)
+            e_max = where(lower, e_max, e)
+            f_max = where(lower, f_max, f)
+            side  = where(lower, 1.0, -1.0)
+            e_opt = where(done, e_opt, e)
+            done  = done | (f==0) | ((e_max-e_min)<rtol*e_crit)
+        return e_opt
+
+    # a, e and p of each tree at the solved e_opt
+    def get_optima_output(self, e_opt, d_leaf, ca, t_leaf, par):
+        a_opt = self.get_a_deriv(e_opt, d_leaf, ca, t_leaf, par)[0]
+        p_opt = self.get_p_leaf(e_opt)
+        return a_opt, e_opt, p_opt
+
+    # the optimizers below are those of gain_risk_model for all the trees,
+    #     the drivers may be scalars or arrays of n_tree, and a_opt, e_opt and
+    #     p_opt are arrays of n_tree
+    def get_optima_dewar(self, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, rtol=1E-6):
+        return self.get_optima_marginal("dewar", d_leaf, ca, t_leaf, par, rtol)
+
+    def get_optima_dewar_mod(self, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, rtol=1E-6):
+        return self.get_optima_marginal("dewar_mod", d_leaf, ca, t_leaf, par, rtol)
+
+    def get_optima_eller(self, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, rtol=1E-6):
+        return self.get_optima_marginal("eller", d_leaf, ca, t_leaf, par, rtol)
+
+    def get_optima_lambda(self, lambd=0.0, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, rtol=1E-6):
+        return self.get_optima_marginal("lambda", d_leaf, ca, t_leaf, par, rtol, lambd=lambd)
+
+    def get_optima_prentice(self, ce=1.0, cv=1.0, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, rtol=1E-6):
+        return self.get_optima_marginal("prentice", d_leaf, ca, t_leaf, par, rtol, ce=ce, cv=cv)
+
+    # the scan of gain_risk_model.get_optima_sperry, on the (N_SPERRY, n_tree)
+    #     supply grid
+    def get_optima_sperry(self, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0):
+        list_e,list_p,list_dp,list_d2p = self.get_supply_grid(N_SPERRY)
+        list_a = get_a_ci_array(self.vmax, self.jmax, 2.5, self.get_g(list_e, d_leaf), ca, t_leaf, par)[1]
+        site   = get_sperry_site(list_a, 1.0/list_dp)
+        trees  = arange(self.n_tree)
+        return self.get_output(list_a[site,trees], list_e[site,trees], list_p[site,trees], d_leaf)
+
+    def get_optima_wang(self, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, rtol=1E-6):
+        return self.get_optima_marginal("wang", d_leaf, ca, t_leaf, par, rtol)
+
+    def get_optima_wap(self, aa=0.1, bb=0.1, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, rtol=1E-6):
+        return self.get_optima_marginal("wap", d_leaf, ca, t_leaf, par, rtol, aa=aa, bb=bb)
+
+    # legacy of each layer of each tree after flow e, the most negative pressure
+    #     it has been at
+    def update_legacy(self, e):
+        tension = self.p_soil
+        for name in self.segments:
+            if name=="rhiz":
+                tension = p_rhiz_array(e,
+                                       tension,
+                                       self.p_ssat,
+                                       self.c_ssat,
+                                       self.b_ssat,
+                                       self.k_rhiz,
+                                       self.n_shell)
+            else:
+                legacy = getattr(self, "l_"+name)
+                profile,tension = p_layers_profile_array(e,
+                                                         tension,
+                                                         legacy.T,
+                                                         getattr(self, "b_"+name),
+                                                         getattr(self, "c_"+name),
+                                                         getattr(self, "k_"+name),
+                                                         getattr(self, "h_"+name),
+                                                         self.get_n_layer(name))
+                if legacy.shape[1]>0:
+                    legacy[:] = maximum(legacy, profile.T)
+
+
+
+
+if __name__ == "__main__":
+    from time  import perf_counter
+    from numpy import random
+
+    # 2000 aspen trees with scattered traits, against one model per tree
+    rng    = random.default_rng(0)
+    n_tree = 2000
+    stand  = gain_risk_ensemble("aspen", n_tree,
+                                k_stem=rng.uniform(2000.0, 8000.0, n_tree),
+                                b_leaf=rng.uniform(1.2, 2.2, n_tree),
+                                vmax=rng.uniform(40.0, 80.0, n_tree),
+                                p_soil=rng.uniform(0.01, 0.5, n_tree))
+    stand.get_tree(0).get_optima_wang()
+    for criterion in ["wang", "eller", "sperry"]:
+        start = perf_counter()
+        stand.clear_supply_cache()
+        a_opt,e_opt,p_opt = getattr(stand, "get_optima_"+criterion)(d_leaf=2.0, par=1500.0)
+        t_ens = perf_counter() - start
+        start = perf_counter()
+        error = 0.0
+        for i in range(0, n_tree, 20):
+            a,e,p = getattr(stand.get_tree(i), "get_optima_"+criterion)(d_leaf=2.0, par=1500.0)
+            error = max(error, abs(e_opt[i]-e)/e, abs(a_opt[i]-a)/a)
+        t_obj = (perf_counter() - start) * 20
+        print("%-6s ensemble %.2f s, models %.2f s, max relative error %.1e" % (criterion, t_ens, t_obj, error))
@@ -0,0 +1,635 @@
+# -*- coding: utf-8 -*-
+
+from math import sqrt
+from numpy import argmax,asarray,linspace,log,searchsorted,zeros
+from scipy.optimize import brentq,minimize_scalar
+
+from hydraulics     import p_layers_array,p_layers_deriv_array,p_layers_profile,p_rhiz_array,p_rhiz_deriv_array,supply_curve_cache
+from jit_kernels    import JIT_ENABLED,p_layers_deriv_grid_kernel,p_layers_deriv_kernel,p_layers_kernel,p_rhiz_deriv_grid_kernel,p_rhiz_deriv_kernel,p_rhiz_kernel
+from photosynthesis import get_a_ci,get_a_ci_grid,get_a_ci_seg_deriv,get_a_ci_seg_deriv_grid
+
+
+
+
+# species presets, the segments from soil to leaf and the traits of each
+#     "rhiz" is the rhizosphere, made of n_shell shells and using the soil traits
+#     any other segment X is made of n_layer weibull layers, with traits k_X, b_X,
+#     c_X and h_X, and legacy l_X if has_legacy
+#     output_g makes the optimizers return g instead of e as the second value
+PRESETS = {
+    "aspen": {
+        "segments"  : ("rhiz", "root", "stem", "leaf"),
+        "has_legacy": True,
+        "output_g"  : False,
+        "traits"    : {
+            # soil
+            "p_ssat": 0.63*9.8*998.0*1E-6, # p_soil at saturation
+            "p_soil": 0.63*9.8*998.0*1E-6, # current p_soil
+            "c_ssat": 0.476              , # swc at saturation
+            "c_curr": 0.476              , # current swc
+            "b_ssat": 8.52               , # unitless soil property
+            "k_ssat": 0.009              , # m per hour
+            "k_rhiz": 5E8                , # rhizosphere conductance per basal
+            # root
+            "k_root": 2228.0, # root conductance per basal area
+            "b_root": 1.15  , # root weibull b
+            "c_root": 1.07  , # root weibull c
+            # stem
+            "k_stem": 4926.7, # stem conductance per basal area
+            "b_stem": 3.12  , # stem weibull b
+            "c_stem": 2.64  , # stem weibull c
+            # leaf
+            "k_leaf": 5424.3, # leaf conductance per basal area
+            "b_leaf": 1.71  , # leaf weibull b
+            "c_leaf": 1.08  , # leaf weibull c
+            "k_sla" : 1.140 , # leaf conductance per leaf area
+            # tree level
+            "laba"  : 4758.5, # leaf area per basal area
+            "gaba"  : 1000.0, # crown area per basal area
+            "vmax"  : 61.74 , # per leaf area
+            "jmax"  : 111.13, # per leaf area
+            # height related
+            "h_soil": 0.0, # soil depth
+            "h_root": 0.0, # root depth
+            "h_stem": 1.0, # stem height
+            "h_leaf": 0.0, # leaf height
+            # gias related
+            "c_cons": 0.0,
+            "c_pows": 0.3}},
+    "other": {
+        "segments"  : ("tree",),
+        "has_legacy": False,
+        "output_g"  : True,
+        "traits"    : {
+            # tree no soil type given
+            "p_soil": 0.0 , # current p_soil
+            "k_tree": 10.0, # tree conductance per basal area
+            "b_tree": 2.0 , # tree weibull b
+            "c_tree": 5.0 , # tree weibull c
+            "h_tree": 0.0 , # no gravity
+            # tree level
+            "laba"  : 1000.0, # leaf area per basal area
+            "vmax"  : 61.74 , # per leaf area
+            "jmax"  : 111.13, # per leaf area
+            # gias related
+            "c_cons": 0.0,
+            "c_pows": 0.3}}}
+
+# birch differs from aspen in the weibull curves only
+PRESETS["birch"] = {"segments"  : PRESETS["aspen"]["segments"],
+                    "has_legacy": True,
+                    "output_g"  : False,
+                    "traits"    : dict(PRESETS["aspen"]["traits"],
+                                       b_root=1.879, # root weibull b
+                                       c_root=2.396, # root weibull c
+                                       b_stem=2.238, # stem weibull b
+                                       c_stem=9.380, # stem weibull c
+                                       b_leaf=1.897, # leaf weibull b
+                                       c_leaf=2.203)}# leaf weibull c
+
+# criteria of the get_optima_* methods
+CRITERIA = ("dewar", "dewar_mod", "eller", "lambda", "prentice", "sperry", "wang", "wap")
+
+# flows from 0 to e_crit that get_optima_sperry scans
+N_SPERRY = 101
+
+# soil traits used by the rhizosphere segment
+SOIL_ATTRS = ("p_ssat", "p_soil", "c_ssat", "b_ssat", "k_rhiz")
+
+
+
+
+# marginal condition d(objective)/de of a criterion at flow e, positive below
+#     the optimum, from a and da/de, p and dp/de, and k = de/dp and dk/de;
+#     the values a criterion does not use may be None
+#     the values are scalars or arrays, e.g. a grid of e or the trees of an
+#     ensemble, and the parameters of the criteria are keywords as in the
+#     get_optima_* methods
+def get_marginal(criterion, e, a, da, p, dp, k, dk, e_crit, p_crit, vmax, lambd=0.0, ce=1.0, cv=1.0, aa=0.1, bb=0.1):
+    if criterion in ("dewar", "dewar_mod"):
+        return da * (p_crit-p) - a * dp
+    if criterion=="eller":
+        return da * k + a * dk
+    if criterion=="lambda":
+        return da - lambd
+    if criterion=="prentice":
+        return da * (ce*e + cv*vmax) - a * ce
+    if criterion=="wang":
+        return da * (e_crit-e) - a
+    if criterion=="wap":
+        return da - (2.0*aa*p + bb) * dp
+    raise ValueError("%s has no marginal condition" % criterion)
+
+
+
+
+# optimizers of the criteria with a marginal condition, for gain_risk_model and
+#     gain_risk_ensemble
+#     the class provides get_a_deriv, get_p_leaf_deriv, get_k_leaf, get_e_crit,
+#     get_p_crit, solve_optima, get_optima_output and get_output
+class marginal_optima():
+    # the marginal of criterion as a function of flow e, from get_marginal
+    #     with only the curves it uses solved; e_crit and p_crit are given, so
+    #     that callers can solve them once
+    def get_marginal_func(self, criterion, e_crit, p_crit, d_leaf, ca, t_leaf, par, lambd=0.0, ce=1.0, cv=1.0, aa=0.1, bb=0.1):
+        need_p = criterion in ("dewar", "dewar_mod", "wap")
+        need_k = criterion=="eller"
+        def marginal(e):
+            a,da = self.get_a_deriv(e, d_leaf, ca, t_leaf, par)
+            p = dp = k = dk = None
+            if need_p:
+                p,dp = self.get_p_leaf_deriv(e)[:2]
+            elif need_k:
+                k,dk = self.get_k_leaf(e)
+            return get_marginal(criterion, e, a, da, p, dp, k, dk, e_crit, p_crit, self.vmax, lambd, ce, cv, aa, bb)
+        return marginal
+
+    # what get_optima_* returns when the optimum is at flow e_opt
+    def get_optima_values(self, criterion, e_opt, d_leaf, ca, t_leaf, par):
+        a_opt,e_opt,p_opt = self.get_optima_output(e_opt, d_leaf, ca, t_leaf, par)
+        if criterion=="dewar":
+            a_opt = a_opt * p_opt / self.get_p_crit()
+        return self.get_output(a_opt, e_opt, p_opt, d_leaf)
+
+    # optimum of criterion at the zero of its marginal, by solve_optima
+    #     e_guess is passed to solve_optima as a warm start
+    def get_optima_marginal(self, criterion, d_leaf, ca, t_leaf, par, rtol=1E-6, e_guess=None, **params):
+        e_crit   = self.get_e_crit()
+        marginal = self.get_marginal_func(criterion, e_crit, self.get_p_crit(), d_leaf, ca, t_leaf, par, **params)
+        if e_guess is None:
+            e_opt = self.solve_optima(marginal, e_crit, rtol)
+        else:
+            e_opt = self.solve_optima(marginal, e_crit, rtol, e_guess)
+        return self.get_optima_values(criterion, e_opt, d_leaf, ca, t_leaf, par)
+
+
+
+
+# gain-risk model over a list of hydraulic segments
+#     preset is a key of PRESETS, segments overrides its segments, and
+#     n_layer is the layer count of every weibull segment, or a dict of counts
+#     per segment
+class gain_risk_model(supply_curve_cache, marginal_optima):
+    def __init__(self, preset="aspen", segments=None, n_shell=10, n_layer=20):
+        setting  = PRESETS[preset]
+        segments = tuple(setting["segments"] if segments is None else segments)
+        object.__setattr__(self, "SUPPLY_ATTRS", ())
+        self.segments = segments
+        self.n_shell  = n_shell
+        self.n_layer  = n_layer
+        self.output_g = setting["output_g"]
+        for key,value in setting["traits"].items():
+            setattr(self, key, value)
+        # legacy, the pressure history of each layer
+        for name in self.get_xylem():
+            if setting["has_legacy"]:
+                setattr(self, "l_"+name, zeros(self.get_n_layer(name)))
+            else:
+                setattr(self, "l_"+name, zeros(0))
+        # attributes that the supply curve depends on
+        supply = ["segments", "n_shell", "n_layer"]
+        if "rhiz" in segments:
+            supply += list(SOIL_ATTRS)
+        else:
+            supply += ["p_soil"]
+        for name in self.get_xylem():
+            supply += [x+"_"+name for x in ("k","b","c","h","l")]
+        object.__setattr__(self, "SUPPLY_ATTRS", tuple(supply))
+        object.__setattr__(self, "LEGACY_ATTRS", tuple("l_"+name for name in self.get_xylem()))
+        self.clear_supply_cache()
+        # photosynthesis functions, may be replaced by those of an a_ci_table
+        self.get_a_ci                = get_a_ci
+        self.get_a_ci_seg_deriv      = get_a_ci_seg_deriv
+        self.get_a_ci_grid           = get_a_ci_grid
+        self.get_a_ci_seg_deriv_grid = get_a_ci_seg_deriv_grid
+    
+    # the weibull segments
+    def get_xylem(self):
+        return [name for name in self.segments if name!="rhiz"]
+    
+    def get_n_layer(self, name):
+        if isinstance(self.n_layer, dict):
+            return self.n_layer[name]
+        return self.n_layer
+    
+    # p_crit of the last segment, where its conductance is 1/1000 of the maximum
+    def get_p_crit(self):
+        name = self.segments[-1]
+        b    = getattr(self, "b_"+name)
+        c    = getattr(self, "c_"+name)
+        return b * log(1000.0) ** (1.0/c)
+    
+    # g (gc*10) at flow e
+    def get_g(self, e, d_leaf):
+        f   = e * 0.0154321
+        gh  = f / self.laba / d_leaf * 100.0
+        gc  = gh / 1.6 / (1.0 + self.c_cons * gh**self.c_pows)
+        return gc * 10.0
+    
+    # the optimizers return a, e (or g*1.6 if output_g) and p
+    def get_output(self, a_opt, e_opt, p_opt, d_leaf):
+        if self.output_g:
+            return a_opt, self.get_g(e_opt,d_leaf)*1.6, p_opt
+        return a_opt, e_opt, p_opt
+    
+    # pressure downstream of each segment, from soil to leaf
+    #     flow is a scalar, or an array if array_form
+    def get_p_segments(self, flow, array_form=False):
+        if array_form:
+            p_rhiz,p_layers = p_rhiz_array,p_layers_array
+        else:
+            p_rhiz,p_layers = p_rhiz_kernel,p_layers_kernel
+        tension = self.p_soil
+        list_p  = []
+        for name in self.segments:
+            if name=="rhiz":
+                tension = p_rhiz(flow,
+                                 tension,
+                                 self.p_ssat,
+                                 self.c_ssat,
+                                 self.b_ssat,
+                                 self.k_rhiz,
+                                 self.n_shell)
+            else:
+                tension = p_layers(flow,
+                                   tension,
+                                   getattr(self, "l_"+name),
+                                   getattr(self, "b_"+name),
+                                   getattr(self, "c_"+name),
+                                   getattr(self, "k_"+name),
+                                   getattr(self, "h_"+name),
+                                   self.get_n_layer(name))
+            list_p.append(tension)
+        return list_p
+    
+    # pressure that the conductance of each layer of each weibull segment is
+    #     computed from at flow, i.e. at the upstream end of the layer, for the
+    #     legacy of a drought
+    def get_p_profile(self, flow):
+        tension = self.p_soil
+        profile = {}
+        for name in self.segments:
+            if name=="rhiz":
+                tension = p_rhiz_kernel(flow,
+                                        tension,
+                                        self.p_ssat,
+                                        self.c_ssat,
+                                        self.b_ssat,
+                                        self.k_rhiz,
+                                        self.n_shell)
+            else:
+                profile[name],tension = p_layers_profile(flow,
+                                                         tension,
+                                                         getattr(self, "l_"+name),
+                                                         getattr(self, "b_"+name),
+                                                         getattr(self, "c_"+name),
+                                                         getattr(self, "k_"+name),
+                                                         getattr(self, "h_"+name),
+                                                         self.get_n_layer(name))
+        return profile
+    
+    # p_leaf at flow, and dp/de too if deriv
+    def get_p_leaf(self, flow, deriv=False):
+        if deriv:
+            return self.get_p_leaf_deriv(flow)[:2]
+        return self.get_p_segments(flow)[-1]
+    
+    # p_leaf at an array of flows in one vectorized pass, same as get_p_leaf
+    def get_p_leaf_array(self, flow, deriv=False):
+        if deriv:
+            return self.get_p_leaf_deriv(flow, True)[:2]
+        return self.get_p_segments(flow, True)[-1]
+    
+    # p_leaf and its first and second derivatives with flow, carried through
+    #     the segments in the same pass as p_leaf
+    #     arrays of flows go through the grid kernels if numba is installed
+    def get_p_leaf_deriv(self, flow, array_form=False):
+        if array_form and JIT_ENABLED:
+            flow = asarray(flow, dtype=float)
+            p,dp,d2p = self.get_p_leaf_deriv_grid(flow.ravel())
+            return p.reshape(flow.shape), dp.reshape(flow.shape), d2p.reshape(flow.shape)
+        if array_form:
+            p_rhiz,p_layers = p_rhiz_deriv_array,p_layers_deriv_array
+        else:
+            p_rhiz,p_layers = p_rhiz_deriv_kernel,p_layers_deriv_kernel
+        tension   = self.p_soil
+        dtension  = 0.0
+        d2tension = 0.0
+        for name in self.segments:
+            if name=="rhiz":
+                tension,dtension,d2tension = p_rhiz(flow,
+                                                    tension,
+                                                    self.p_ssat,
+                                                    self.c_ssat,
+                                                    self.b_ssat,
+                                                    self.k_rhiz,
+                                                    self.n_shell)
+            else:
+                tension,dtension,d2tension = p_layers(flow,
+                                                      tension,
+                                                      dtension,
+                                                      d2tension,
+                                                      getattr(self, "l_"+name),
+                                                      getattr(self, "b_"+name),
+                                                      getattr(self, "c_"+name),
+                                                      getattr(self, "k_"+name),
+                                                      getattr(self, "h_"+name),
+                                                      self.get_n_layer(name))
+        return tension, dtension, d2tension
+    
+    def get_p_leaf_deriv_grid(self, flow):
+        tension   = self.p_soil + zeros(len(flow))
+        dtension  = zeros(len(flow))
+        d2tension = zeros(len(flow))
+        for name in self.segments:
+            if name=="rhiz":
+                tension,dtension,d2tension = p_rhiz_deriv_grid_kernel(flow,
+                                                                      self.p_soil,
+                                                                      self.p_ssat,
+                                                                      self.c_ssat,
+                                                                      self.b_ssat,
+                                                                      self.k_rhiz,
+                                                                      self.n_shell)
+            else:
+                tension,dtension,d2tension = p_layers_deriv_grid_kernel(flow,
+                                                                        tension,
+                                                                        dtension,
+                                                                        d2tension,
+                                                                        getattr(self, "l_"+name),
+                                                                        getattr(self, "b_"+name),
+                                                                        getattr(self, "c_"+name),
+                                                                        getattr(self, "k_"+name),
+                                                                        getattr(self, "h_"+name),
+                                                                        self.get_n_layer(name))
+        return tension, dtension, d2tension
+    
+    # whole plant conductance k = de/dp at flow, and dk/de = -d2p/de2 / (dp/de)**2
+    def get_k_leaf(self, flow):
+        p,dp,d2p = self.get_p_leaf_deriv(flow)
+        return 1.0/dp, -d2p/dp**2
+    
+    def get_k_leaf_array(self, flow):
+        p,dp,d2p = self.get_p_leaf_deriv(flow, True)
+        return 1.0/dp, -d2p/dp**2
+    
+    # e at p_crit, cached by get_e_crit until the hydraulic state changes
+    #     with e_guess, e.g. the e_crit of the previous time step, it is solved
+    #     by newton steps from there, kept inside the bracket found so far
+    def solve_e_crit(self, e_guess=None):
+        p_crit = self.get_p_crit()
+        if e_guess is not None and e_guess>0:
+            e_min = 0.0
+            e_max = None
+            e     = e_guess
+            for i in range(50):
+                p,dp = self.get_p_leaf(e, True)
+                if abs(p-p_crit)<1E-3:
+                    return e
+                if p>p_crit:
+                    e_max = e
+                else:
+                    e_min = e
+                if e_max is not None and (e_max-e_min)<1E-3:
+                    return e
+                e = e - (p-p_crit) / dp
+                if e_max is None and not e>e_min:
+                    e = 2.0 * e_min
+                elif e_max is not None and not e_min<e<e_max:
+                    e = 0.5 * (e_min+e_max)
+        e_min  = 0.0
+        e_max  = 100.0
+        e_crit = 50.0
+        while True:
+            p = self.get_p_leaf(e_max)
+            if p<p_crit:
+                e_max *= 2.0
+            else:
+                break
+        while True:
+            e = 0.5 * (e_max+e_min)
+            p = self.get_p_leaf(e)
+            if abs(p-p_crit)<1E-3 or (e_max-e_min)<1E-3:
+                e_crit = e
+                break
+            if p>p_crit:
+                e_max  = e
+            else:
+                e_min  = e
+        return e_crit
+    
+    # g and dg/de at flow e
+    def get_g_deriv(self, e, d_leaf):
+        f   = e * 0.0154321
+        gh  = f / self.laba / d_leaf * 100.0
+        dgh = 0.0154321 / self.laba / d_leaf * 100.0
+        den = 1.0 + self.c_cons * gh**self.c_pows
+        gc  = gh / 1.6 / den
+        dgc = dgh / 1.6 * (1.0 + self.c_cons * (1.0-self.c_pows) * gh**self.c_pows) / den**2
+        return gc * 10.0, dgc * 10.0
+    
+    # segmented a and da/de at flow e
+    def get_a_deriv(self, e, d_leaf, ca, t_leaf, par):
+        g,dg   = self.get_g_deriv(e, d_leaf)
+        c,a,da = self.get_a_ci_seg_deriv(self.vmax,
+                                         self.jmax,
+                                         2.5,
+                                         g,
+                                         ca,
+                                         t_leaf,
+                                         par)
+        return a, da*dg
+    
+    # e where the marginal condition func(e) crosses zero from above, solved
+    #     by brent's method in [0, e_crit] to a tolerance of rtol*e_crit
+    #     if func does not change sign, the optimum is at 0 or e_crit
+    #     with e_guess, e.g. the optimum of the previous time step, brent's method
+    #     starts from a bracket of e_guess -/+ 5% of e_crit if the root is in it
+    def solve_optima(self, func, e_crit, rtol, e_guess=None):
+        values = {}
+        def func_memo(e):
+            if e not in values:
+                values[e] = func(e)
+            return values[e]
+        e_min = 0.0
+        e_max = e_crit
+        if e_guess is not None:
+            width = 0.05 * e_crit
+            e_low = max(e_guess-width, 0.0)
+            e_upp = min(e_guess+width, e_crit)
+            if func_memo(e_low)>0 and func_memo(e_upp)<0:
+                e_min = e_low
+                e_max = e_upp
+        try:
+            return brentq(func_memo, e_min, e_max, xtol=rtol*e_crit, rtol=max(rtol,1E-15))
+        except ValueError:
+            return 0.0 if func_memo(0.0)<=0 else e_crit
+    
+    # a, e and p at the solved e_opt
+    def get_optima_output(self, e_opt, d_leaf, ca, t_leaf, par):
+        a_opt = self.get_a_deriv(e_opt, d_leaf, ca, t_leaf, par)[0]
+        p_opt = self.get_p_leaf(e_opt)
+        return a_opt, e_opt, p_opt
+    
+    # the optimizers below solve d(objective)/de = 0 with analytic da/de and
+    #     dp/de, by get_optima_marginal
+    def get_optima_dewar(self, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, rtol=1E-6, e_guess=None):
+        return self.get_optima_marginal("dewar", d_leaf, ca, t_leaf, par, rtol, e_guess)
+    
+    def get_optima_dewar_mod(self, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, rtol=1E-6, e_guess=None):
+        return self.get_optima_marginal("dewar_mod", d_leaf, ca, t_leaf, par, rtol, e_guess)
+    
+    # maximizes a*k with k = de/dp, i.e. da/de * k + a * dk/de = 0
+    def get_optima_eller(self, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, rtol=1E-6, e_guess=None):
+        return self.get_optima_marginal("eller", d_leaf, ca, t_leaf, par, rtol, e_guess)
+    
+    def get_optima_lambda(self, lambd=0.0, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, rtol=1E-6, e_guess=None):
+        return self.get_optima_marginal("lambda", d_leaf, ca, t_leaf, par, rtol, e_guess, lambd=lambd)
+    
+    def get_optima_prentice(self, ce=1.0, cv=1.0, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, rtol=1E-6, e_guess=None):
+        return self.get_optima_marginal("prentice", d_leaf, ca, t_leaf, par, rtol, e_guess, ce=ce, cv=cv)
+    
+    # sperry's profit, the gain a/max(a) of the colimited a minus the risk
+    #     1-k/max(k), at the best of N_SPERRY flows from 0 to e_crit; p and
+    #     k = de/dp come from the cached supply grid
+    def get_optima_sperry(self, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, adaptive=False, precision=1E-4, n_scan=11):
+        if adaptive:
+            return self.get_optima_sperry_adaptive(d_leaf, ca, t_leaf, par, precision, n_scan)
+        list_e,list_p,list_dp,list_d2p = self.get_supply_grid(N_SPERRY)
+        list_a   = self.get_a_ci_grid(self.vmax, self.jmax, 2.5, self.get_g(list_e, d_leaf), ca, t_leaf, par)[1]
+        opt_site = get_sperry_site(list_a, 1.0/list_dp)
+        return self.get_output(list_a[opt_site], list_e[opt_site], list_p[opt_site], d_leaf)
+    
+    # a from get_a_ci and k = de/dp at flow e, for the sperry profit
+    def get_a_k(self, e, d_leaf, ca, t_leaf, par):
+        g   = self.get_g(e, d_leaf)
+        c,a = self.get_a_ci(self.vmax,
+                            self.jmax,
+                            2.5,
+                            g,
+                            ca,
+                            t_leaf,
+                            par)
+        return a, self.get_k_leaf(e)[0]
+    
+    # sperry optimum from a coarse scan of n_scan points, refined by brent's
+    #     method in the two intervals next to the best point, to precision*e_crit
+    #     a and k are normalized by their maxima in the scan as in the full scan
+    def get_optima_sperry_adaptive(self, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, precision=1E-4, n_scan=11):
+        e_crit = self.get_e_crit()
+        list_e = linspace(0.0, e_crit, n_scan)
+        list_a = []
+        list_k = []
+        for e in list_e:
+            a,k = self.get_a_k(e, d_leaf, ca, t_leaf, par)
+            list_a.append(a)
+            list_k.append(k)
+        a_max = max(list_a)
+        k_max = max(list_k)
+        prof  = [a/a_max - 1.0 + k/k_max for a,k in zip(list_a,list_k)]
+        opt_site = prof.index(max(prof))
+        e_min = list_e[max(opt_site-1, 0)]
+        e_max = list_e[min(opt_site+1, n_scan-1)]
+        def loss(e):
+            a,k = self.get_a_k(e, d_leaf, ca, t_leaf, par)
+            return 1.0 - a/a_max - k/k_max
+        result = minimize_scalar(loss,
+                                 bounds=(e_min,e_max),
+                                 method="bounded",
+                                 options={"xatol": precision*e_crit})
+        if -result.fun > prof[opt_site]:
+            opt_e = result.x
+        else:
+            opt_e = list_e[opt_site]
+        opt_a = self.get_a_k(opt_e, d_leaf, ca, t_leaf, par)[0]
+        opt_p = self.get_p_leaf(opt_e)
+        return self.get_output(opt_a, opt_e, opt_p, d_leaf)
+    
+    def get_optima_wang(self, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, rtol=1E-6, e_guess=None):
+        return self.get_optima_marginal("wang", d_leaf, ca, t_leaf, par, rtol, e_guess)
+    
+    def get_optima_wap(self, aa=0.1, bb=0.1, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, rtol=1E-6, e_guess=None):
+        return self.get_optima_marginal("wap", d_leaf, ca, t_leaf, par, rtol, e_guess, aa=aa, bb=bb)
+    
+    # optima of several criteria from curves of a, p and k on one e grid
+    #     p, dp/de and d2p/de2 on the grid come from the cached supply grid, so
+    #     that only a and da/de are solved for each driver set, in one array
+    #     call; the grid brackets the first downward zero crossing of each
+    #     marginal, which is interpolated by a parabola, and a and p are
+    #     interpolated there from the curves and their derivatives
+    #     sperry is get_optima_sperry, which shares the supply grid if n_grid
+    #     is N_SPERRY
+    #     the parameters of the criteria are keywords as in the get_optima_*
+    #     methods, returns a dict of (a_opt, e_opt, p_opt) by criterion
+    def get_optima_all(self, d_leaf=1.5, ca=40.0, t_leaf=25.0, par=1000.0, criteria=CRITERIA, n_grid=N_SPERRY, lambd=0.0, ce=1.0, cv=1.0, aa=0.1, bb=0.1):
+        e_crit = self.get_e_crit()
+        p_crit = self.get_p_crit()
+        # the curves on the grid
+        list_e,p,dp,d2p = self.get_supply_grid(n_grid)
+        g,dg   = self.get_g_deriv(list_e, d_leaf)
+        c,a,da = self.get_a_ci_seg_deriv_grid(self.vmax, self.jmax, 2.5, g, ca, t_leaf, par)
+        da     = da * dg
+        k  = 1.0 / dp
+        dk = -d2p / dp**2
+        optima = {}
+        for criterion in criteria:
+            if criterion=="sperry":
+                optima[criterion] = self.get_optima_sperry(d_leaf, ca, t_leaf, par)
+                continue
+            values = get_marginal(criterion, list_e, a, da, p, dp, k, dk, e_crit, p_crit, self.vmax, lambd=lambd, ce=ce, cv=cv, aa=aa, bb=bb)
+            if values[0]<=0:
+                e_opt = 0.0
+            elif not (values<=0).any():
+                e_opt = e_crit
+            else:
+                e_opt = get_parabola_root(list_e, values, int(argmax(values<=0)))
+            a_opt = get_hermite(list_e, a, da, e_opt)
+            p_opt = get_hermite(list_e, p, dp, e_opt)
+            if criterion=="dewar":
+                a_opt = a_opt * p_opt / p_crit
+            optima[criterion] = self.get_output(a_opt, e_opt, p_opt, d_leaf)
+        return optima
+
+
+
+# grid point of the maximum sperry profit, gain minus risk, along the first
+#     axis, e.g. for each tree of an ensemble
+def get_sperry_site(list_a, list_k):
+    gain = list_a / list_a.max(axis=0)
+    risk = 1.0 - list_k / list_k.max(axis=0)
+    return argmax(gain - risk, axis=0)
+
+# y at x0 from the cubic hermite of y and its derivative dy on the grid x
+def get_hermite(x, y, dy, x0):
+    i  = min(max(int(searchsorted(x, x0)), 1), len(x)-1)
+    h  = x[i] - x[i-1]
+    t  = (x0 - x[i-1]) / h
+    return (  (2*t**3 - 3*t**2 + 1) * y[i-1] + (t**3 - 2*t**2 + t) * h * dy[i-1]
+            + (3*t**2 - 2*t**3)     * y[i]   + (t**3 - t**2)       * h * dy[i] )
+
+# parabola through three points of the grid x, centered on i where possible
+def get_parabola(x, y, i):
+    j = min(max(i-1, 0), len(x)-3)
+    x0,x1,x2 = x[j:j+3]
+    y0,y1,y2 = y[j:j+3]
+    d01 = (y1-y0) / (x1-x0)
+    d12 = (y2-y1) / (x2-x1)
+    qa  = (d12-d01) / (x2-x0)
+    qb  = d01 - qa*(x0+x1)
+    qc  = y0 - x0*(qa*x0+qb)
+    return qa, qb, qc
+
+# root of y in [x[i-1], x[i]] from the parabola through the cell and the next
+#     point, or the linear interpolation if the parabola has no root in the cell,
+#     e.g. at a kink of the segmented photosynthesis
+def get_parabola_root(x, y, i):
+    x_lin = x[i-1] + (x[i]-x[i-1]) * y[i-1] / (y[i-1]-y[i])
+    qa,qb,qc = get_parabola(x, y, i)
+    if qa==0:
+        return x_lin
+    qd = qb*qb - 4.0*qa*qc
+    if qd<0:
+        return x_lin
+    for root in ((-qb+sqrt(qd))/(2.0*qa), (-qb-sqrt(qd))/(2.0*qa)):
+        if x[i-1]<=root<=x[i]:
+            return root
+    return x_lin
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+from numpy import array,array_equal,asarray,errstate,exp,linspace,log,maximum,where,zeros
+from scipy.interpolate import PchipInterpolator
+
+
+
+
+# array versions of the hydraulic kernels in jit_kernels.py
+#     flow is an array of flows, and the pressures of all the flows are
+#     stepped through the shells and layers together
+
+# pressure at the root surface, flow through n_shell rhizosphere shells
+def p_rhiz_array(flow, p_soil, p_ssat, c_ssat, b_ssat, k_rhiz, n_shell):
+    flow    = asarray(flow, dtype=float)
+    tension = p_soil + 0.0*flow
+    dp      = 0.0*flow
+    step    = 9.0 / n_shell
+    for i in range(n_shell):
+        with errstate(divide="ignore", invalid="ignore"):
+            shell_t = where(tension>p_ssat, c_ssat * (tension/p_ssat)**(-1.0/b_ssat), c_ssat)
+        shell_f  = (shell_t/c_ssat) ** (2.0*b_ssat+3)
+        shell_k  = k_rhiz * shell_f * log(10.0) / log((10.0-step*i)/(10.0-step*(i+1)))
+        shell_k  = maximum(shell_k, 1E-12)
+        dp      += flow / shell_k
+        tension  = p_soil + dp
+    return tension
+
+# pressure at the downstream end of n_layer weibull layers, including gravity
+#     p_up may be an array of the same shape as flow
+#     legacy is the pressure history of each layer, and is not used if empty
+def p_layers_array(flow, p_up, legacy, b, c, k, h, n_layer):
+    flow    = asarray(flow, dtype=float)
+    tension = p_up + 0.0*flow
+    dp      = 0.0*flow
+    for i in range(n_layer):
+        if len(legacy)>0:
+            p = maximum(legacy[i],tension)
+        else:
+            p = tension
+        f = exp( -1.0 * (p/b)**c )
+        layer_k = k * n_layer * f
+        layer_k = maximum(layer_k, 1E-12)
+        dp += flow / layer_k + 998.0*9.8*h*(1.0/n_layer)*1E-6
+        tension = p_up + dp
+    return tension
+
+# p_layers_kernel that also returns the pressure each layer's conductance is
+#     computed from, i.e. at the upstream end of each layer
+def p_layers_profile(flow, p_up, legacy, b, c, k, h, n_layer):
+    tension = p_up
+    dp      = 0.0
+    profile = zeros(n_layer)
+    for i in range(n_layer):
+        profile[i] = tension
+        if len(legacy)>0:
+            p = max(legacy[i],tension)
+        else:
+            p = tension
+        f = exp( -1.0 * (p/b)**c )
+        layer_k = k * n_layer * f
+        layer_k = max(layer_k, 1E-12)
+        dp += flow / layer_k + 998.0*9.8*h*(1.0/n_layer)*1E-6
+        tension = p_up + dp
+    return profile, tension
+
+# array version of p_layers_profile, the profile has a leading layer axis
+def p_layers_profile_array(flow, p_up, legacy, b, c, k, h, n_layer):
+    flow    = asarray(flow, dtype=float)
+    tension = p_up + 0.0*flow
+    dp      = 0.0*flow
+    profile = zeros((n_layer,)+tension.shape)
+    for i in range(n_layer):
+        profile[i] = tension
+        if len(legacy)>0:
+            p = maximum(legacy[i],tension)
+        else:
+            p = tension
+        f = exp( -1.0 * (p/b)**c )
+        layer_k = k * n_layer * f
+        layer_k = maximum(layer_k, 1E-12)
+        dp += flow / layer_k + 998.0*9.8*h*(1.0/n_layer)*1E-6
+        tension = p_up + dp
+    return profile, tension
+
+# array versions of p_rhiz_deriv_kernel and p_layers_deriv_kernel, returning
+#     the pressure and its first and second derivatives with flow
+def p_rhiz_deriv_array(flow, p_soil, p_ssat, c_ssat, b_ssat, k_rhiz, n_shell):
+    flow      = asarray(flow, dtype=float)
+    tension   = p_soil + 0.0*flow
+    dtension  = 0.0*flow
+    d2tension = 0.0*flow
+    dp        = 0.0*flow
+    ddp       = 0.0*flow
+    d2dp      = 0.0*flow
+    step      = 9.0 / n_shell
+    m         = (2.0*b_ssat+3) / b_ssat
+    for i in range(n_shell):
+        with errstate(divide="ignore", invalid="ignore"):
+            shell_t = where(tension>p_ssat, c_ssat * (tension/p_ssat)**(-1.0/b_ssat), c_ssat)
+        shell_f  = (shell_t/c_ssat) ** (2.0*b_ssat+3)
+        shell_k  = k_rhiz * shell_f * log(10.0) / log((10.0-step*i)/(10.0-step*(i+1)))
+        shell_k  = maximum(shell_k, 1E-12)
+        r        = 1.0 / shell_k
+        active   = (tension>p_ssat) & (shell_k>1E-12)
+        with errstate(divide="ignore", invalid="ignore"):
+            r_t  = where(active, m * r / tension, 0.0)
+            r_tt = where(active, m * (m-1.0) * r / tension**2, 0.0)
+        dr    = r_t * dtension
+        d2r   = r_tt * dtension**2 + r_t * d2tension
+        dp   += flow * r
+        ddp  += r + flow * dr
+        d2dp += 2.0 * dr + flow * d2r
+        tension   = p_soil + dp
+        dtension  = ddp + 0.0
+        d2tension = d2dp + 0.0
+    return tension, dtension, d2tension
+
+def p_layers_deriv_array(flow, p_up, dp_up, d2p_up, legacy, b, c, k, h, n_layer):
+    flow      = asarray(flow, dtype=float)
+    tension   = p_up + 0.0*flow
+    dtension  = dp_up + 0.0*flow
+    d2tension = d2p_up + 0.0*flow
+    dp        = 0.0*flow
+    ddp       = 0.0*flow
+    d2dp      = 0.0*flow
+    for i in range(n_layer):
+        if len(legacy)>0:
+            upper = legacy[i]>=tension
+            p     = where(upper, legacy[i], tension)
+            dq    = where(upper, 0.0, dtension)
+            d2q   = where(upper, 0.0, d2tension)
+        else:
+            p,dq,d2q = tension,dtension,d2tension
+        f = exp( -1.0 * (p/b)**c )
+        layer_k = k * n_layer * f
+        layer_k = maximum(layer_k, 1E-12)
+        r       = 1.0 / layer_k
+        active  = (layer_k>1E-12) & (p>0)
+        with errstate(divide="ignore", invalid="ignore", over="ignore"):
+            x    = c / b * (p/b)**(c-1.0)
+            r_p  = where(active, r * x, 0.0)
+            r_pp = where(active, r * (x*x + c * (c-1.0) / b**2 * (p/b)**(c-2.0)), 0.0)
+        dr    = r_p * dq
+        d2r   = r_pp * dq**2 + r_p * d2q
+        dp   += flow * r + 998.0*9.8*h*(1.0/n_layer)*1E-6
+        ddp  += r + flow * dr
+        d2dp += 2.0 * dr + flow * d2r
+        tension   = p_up + dp
+        dtension  = dp_up + ddp
+        d2tension = d2p_up + d2dp
+    return tension, dtension, d2tension
+
+
+
+
+# cached supply curve for the gain_risk models
+#     the model sets SUPPLY_ATTRS to the attributes its p_leaf depends on, and
+#     LEGACY_ATTRS to its legacy arrays; assigning any of them clears the cache,
+#     and the legacy arrays are also compared with a copy so that changes made
+#     in place are seen too
+#     the model provides solve_e_crit, get_p_leaf_array and get_p_leaf_deriv
+class supply_curve_cache():
+    SUPPLY_ATTRS = ()
+    LEGACY_ATTRS = ()
+    N_SUPPLY     = 1001
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self.SUPPLY_ATTRS:
+            self.clear_supply_cache()
+
+    def clear_supply_cache(self):
+        self.__dict__["supply_e_crit"] = None
+        self.__dict__["supply_curve" ] = None
+        self.__dict__["supply_grids" ] = {}
+        self.__dict__["supply_legacy"] = None
+
+    def check_supply_cache(self):
+        legacy = self.__dict__.get("supply_legacy")
+        if legacy is None:
+            return
+        for name,copy in zip(self.LEGACY_ATTRS, legacy):
+            if not array_equal(getattr(self,name), copy):
+                self.clear_supply_cache()
+                return
+
+    def set_supply_legacy(self):
+        if self.__dict__.get("supply_legacy") is None:
+            self.__dict__["supply_legacy"] = [array(getattr(self,name)) for name in self.LEGACY_ATTRS]
+
+    # cached e_crit, solved again only after the hydraulic state changed
+    #     e_guess is passed to solve_e_crit as a warm start
+    def get_e_crit(self, e_guess=None):
+        self.check_supply_cache()
+        if self.__dict__.get("supply_e_crit") is None:
+            self.set_supply_legacy()
+            if e_guess is None:
+                self.__dict__["supply_e_crit"] = self.solve_e_crit()
+            else:
+                self.__dict__["supply_e_crit"] = self.solve_e_crit(e_guess)
+        return self.supply_e_crit
+
+    # n flows from 0 to e_crit, and p_leaf, dp/de and d2p/de2 at them, cached
+    #     for each n; they do not depend on the drivers, so the optimizers that
+    #     scan a grid of e share them between driver sets
+    def get_supply_grid(self, n):
+        self.check_supply_cache()
+        grids = self.__dict__.setdefault("supply_grids", {})
+        if n not in grids:
+            e_crit = self.get_e_crit()
+            self.set_supply_legacy()
+            list_e = linspace(0.0, e_crit, n)
+            grids[n] = (list_e,) + tuple(self.get_p_leaf_deriv(list_e, True))
+        return grids[n]
+
+    # monotone P(E) and E(P) interpolators from 0 to e_crit
+    def get_supply_curve(self):
+        self.check_supply_cache()
+        if self.__dict__.get("supply_curve") is None:
+            e_crit = self.get_e_crit()
+            self.set_supply_legacy()
+            list_e = linspace(0.0, e_crit, self.N_SUPPLY)
+            list_p = self.get_p_leaf_array(list_e)
+            self.__dict__["supply_curve"] = (PchipInterpolator(list_e, list_p),
+                                             PchipInterpolator(list_p, list_e))
+        return self.supply_curve
+
+    # p_leaf at flow e, interpolated from the cached supply curve
+    def get_p_leaf_interp(self, e):
+        return self.get_supply_curve()[0](e)[()]
+
+    # flow at p_leaf p, interpolated from the cached supply curve
+    def get_e_leaf_interp(self, p):
+        return self.get_supply_curve()[1](p)[()]
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+
+from math import exp,log,sqrt
+
+from numpy import empty,searchsorted
+
+# numba is optional, the kernels are compiled when it is installed and run as
+#     plain python otherwise; either way they give the same numbers
+# the scalar photosynthesis solvers of photosynthesis.py are these kernels
+try:
+    from numba import njit
+    JIT_ENABLED = True
+except ImportError:
+    JIT_ENABLED = False
+    def njit(*args, **kwargs):
+        if len(args)==1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# solve gc*(ca-ci) = v*(ci-gamma)/(ci+k) - r_day for ci, i.e. the positive root of
+#     gc*ci^2 + (v-r_day-gc*(ca-k))*ci - (v*gamma+r_day*k+gc*ca*k) = 0
+# the root is limited to [gamma,ca] as the bisection used to be
+@njit(cache=True)
+def ci_quadratic_kernel(v, k, gamma, r_day, gc, ca):
+    qa = gc
+    qb = v - r_day - gc*(ca-k)
+    qc = -(v*gamma + r_day*k + gc*ca*k)
+    qd = sqrt(qb*qb - 4.0*qa*qc)
+    if qb>=0 and qb+qd>0:
+        ci = -2.0 * qc / (qb+qd)
+    elif qa>0:
+        ci = (qd-qb) / (2.0*qa)
+    else:
+        ci = ca
+    return min(max(ci,gamma), ca)
+
+# ci where the lower of aj and ac meets the supply line
+@njit(cache=True)
+def ci_seg_kernel(vmax, j, km, r_day, gamma, gc, ca):
+    ci_c = ci_quadratic_kernel(vmax, km, gamma, r_day, gc, ca)
+    ci_j = ci_quadratic_kernel(0.25*j, 2.0*gamma, gamma, r_day, gc, ca)
+    return max(ci_c, ci_j)
+
+# ci and segmented Anet from gc and ca once vmax, j, km and r_day are known
+@njit(cache=True)
+def a_ci_seg_kernel(vmax, j, km, r_day, gamma, gc, ca):
+    tar_p = ci_seg_kernel(vmax, j, km, r_day, gamma, gc, ca)
+    aj = j * (tar_p-gamma) / (4.0*(tar_p+2*gamma))
+    ac = vmax * (tar_p-gamma) / (tar_p+km)
+    return tar_p, min(aj,ac) - r_day
+
+# a_ci_seg_kernel and dAnet/dgc, differentiating a(ci) = gc*(ca-ci) gives
+#     dci/dgc = (ca-ci) / (da/dci+gc) with da/dci of the limiting rate at ci
+@njit(cache=True)
+def a_ci_seg_deriv_kernel(vmax, j, km, r_day, gamma, gc, ca):
+    tar_p,a = a_ci_seg_kernel(vmax, j, km, r_day, gamma, gc, ca)
+    if tar_p>=ca or tar_p<=gamma:
+        return tar_p, a, 0.0
+    aj = j * (tar_p-gamma) / (4.0*(tar_p+2*gamma))
+    ac = vmax * (tar_p-gamma) / (tar_p+km)
+    if aj<ac:
+        da = j * 0.75 * gamma / (tar_p+2*gamma)**2
+    else:
+        da = vmax * (km+gamma) / (tar_p+km)**2
+    return tar_p, a, da * (ca-tar_p) / (da+gc)
+
+# ci and colimited Anet from gc and ca once vmax, j, km and r_day are known
+#     ci is where the colimited a meets the supply line, by safeguarded newton;
+#     the colimited a is below min(aj,ac), so the segmented ci is a lower bound
+@njit(cache=True)
+def a_ci_kernel(vmax, j, km, r_day, gamma, gc, ca, adjust):
+    min_p = ci_seg_kernel(vmax, j, km, r_day, gamma, gc, ca)
+    max_p = ca
+    tar_p = min_p
+    for i in range(50):
+        aj  = j * (tar_p-gamma) / (4.0*(tar_p+2*gamma))
+        ac  = vmax * (tar_p-gamma) / (tar_p+km)
+        daj = j * 0.75 * gamma / (tar_p+2*gamma)**2
+        dac = vmax * (km+gamma) / (tar_p+km)**2
+        s   = aj + ac
+        d   = sqrt(max(s*s - 4*adjust*aj*ac, 0.0))
+        af  = (s - d) / adjust * 0.5
+        f   = af - r_day - gc*(ca-tar_p)
+        if f>0:
+            max_p = tar_p
+        else:
+            min_p = tar_p
+        if d>0:
+            da = (daj + dac - (s*(daj+dac) - 2*adjust*(daj*ac+aj*dac))/d) / adjust * 0.5
+        else:
+            da = min(daj,dac)
+        step  = f / (da+gc) if da+gc>0 else 0.0
+        new_p = tar_p - step
+        if not min_p<=new_p<=max_p:
+            new_p = 0.5 * (max_p+min_p)
+        if abs(new_p-tar_p) < 1E-12*max(1.0,tar_p) or max_p-min_p < 1E-12:
+            tar_p = new_p
+            break
+        tar_p = new_p
+    aj = j * (tar_p-gamma) / (4.0*(tar_p+2*gamma))
+    ac = vmax * (tar_p-gamma) / (tar_p+km)
+    af = (aj + ac - sqrt(max((aj+ac)**2.0 - 4*adjust*aj*ac, 0.0)) ) / adjust * 0.5
+    return tar_p, af - r_day
+
+# pressure at the root surface, flow through n_shell rhizosphere shells
+@njit(cache=True)
+def p_rhiz_kernel(flow, p_soil, p_ssat, c_ssat, b_ssat, k_rhiz, n_shell):
+    tension = p_soil
+    dp      = 0.0
+    step    = 9.0 / n_shell
+    for i in range(n_shell):
+        if tension>p_ssat:
+            shell_t = c_ssat * (tension/p_ssat)**(-1.0/b_ssat)
+        else:
+            shell_t = c_ssat
+        shell_f  = (shell_t/c_ssat) ** (2.0*b_ssat+3)
+        shell_k  = k_rhiz * shell_f * log(10.0) / log((10.0-step*i)/(10.0-step*(i+1)))
+        shell_k  = max(shell_k, 1E-12)
+        dp      += flow / shell_k
+        tension  = p_soil + dp
+    return tension
+
+# pressure at the downstream end of n_layer weibull layers, including gravity
+#     legacy is the pressure history of each layer, and is not used if empty
+@njit(cache=True)
+def p_layers_kernel(flow, p_up, legacy, b, c, k, h, n_layer):
+    tension = p_up
+    dp      = 0.0
+    for i in range(n_layer):
+        if len(legacy)>0:
+            p = max(legacy[i],tension)
+        else:
+            p = tension
+        f = exp( -1.0 * (p/b)**c )
+        layer_k = k * n_layer * f
+        layer_k = max(layer_k, 1E-12)
+        dp += flow / layer_k + 998.0*9.8*h*(1.0/n_layer)*1E-6
+        tension = p_up + dp
+    return tension
+
+# p_rhiz_kernel and its first and second derivatives with flow, propagated
+#     through the shells with the shell resistance r = 1/shell_k
+@njit(cache=True)
+def p_rhiz_deriv_kernel(flow, p_soil, p_ssat, c_ssat, b_ssat, k_rhiz, n_shell):
+    tension   = p_soil
+    dtension  = 0.0
+    d2tension = 0.0
+    dp        = 0.0
+    ddp       = 0.0
+    d2dp      = 0.0
+    step      = 9.0 / n_shell
+    m         = (2.0*b_ssat+3) / b_ssat
+    for i in range(n_shell):
+        if tension>p_ssat:
+            shell_t = c_ssat * (tension/p_ssat)**(-1.0/b_ssat)
+        else:
+            shell_t = c_ssat
+        shell_f  = (shell_t/c_ssat) ** (2.0*b_ssat+3)
+        shell_k  = k_rhiz * shell_f * log(10.0) / log((10.0-step*i)/(10.0-step*(i+1)))
+        shell_k  = max(shell_k, 1E-12)
+        r = 1.0 / shell_k
+        if tension>p_ssat and shell_k>1E-12:
+            r_t  = m * r / tension
+            r_tt = m * (m-1.0) * r / tension**2
+        else:
+            r_t  = 0.0
+            r_tt = 0.0
+        dr   = r_t * dtension
+        d2r  = r_tt * dtension**2 + r_t * d2tension
+        dp   += flow * r
+        ddp  += r + flow * dr
+        d2dp += 2.0 * dr + flow * d2r
+        tension   = p_soil + dp
+        dtension  = ddp
+        d2tension = d2dp
+    return tension, dtension, d2tension
+
+# p_layers_kernel and its first and second derivatives with flow, dp_up and
+#     d2p_up are those of p_up
+@njit(cache=True)
+def p_layers_deriv_kernel(flow, p_up, dp_up, d2p_up, legacy, b, c, k, h, n_layer):
+    tension   = p_up
+    dtension  = dp_up
+    d2tension = d2p_up
+    dp        = 0.0
+    ddp       = 0.0
+    d2dp      = 0.0
+    for i in range(n_layer):
+        if len(legacy)>0 and legacy[i]>=tension:
+            p   = legacy[i]
+            dq  = 0.0
+            d2q = 0.0
+        else:
+            p   = tension
+            dq  = dtension
+            d2q = d2tension
+        q = (p/b)**c
+        f = exp( -1.0 * q )
+        layer_k = k * n_layer * f
+        layer_k = max(layer_k, 1E-12)
+        r = 1.0 / layer_k
+        if layer_k>1E-12 and p>0:
+            x    = c * q / p
+            r_p  = r * x
+            r_pp = r * (x*x + c * (c-1.0) * q / p**2)
+        else:
+            r_p  = 0.0
+            r_pp = 0.0
+        dr   = r_p * dq
+        d2r  = r_pp * dq**2 + r_p * d2q
+        dp   += flow * r + 998.0*9.8*h*(1.0/n_layer)*1E-6
+        ddp  += r + flow * dr
+        d2dp += 2.0 * dr + flow * d2r
+        tension   = p_up + dp
+        dtension  = dp_up + ddp
+        d2tension = d2p_up + d2dp
+    return tension, dtension, d2tension
+
+# a_ci_kernel and a_ci_seg_deriv_kernel over arrays of gc and ca in one call
+@njit(cache=True)
+def a_ci_grid_kernel(vmax, j, km, r_day, gamma, gc, ca, adjust):
+    ci = empty(len(gc))
+    a  = empty(len(gc))
+    for i in range(len(gc)):
+        ci[i],a[i] = a_ci_kernel(vmax, j, km, r_day, gamma, gc[i], ca[i], adjust)
+    return ci, a
+
+@njit(cache=True)
+def a_ci_seg_deriv_grid_kernel(vmax, j, km, r_day, gamma, gc, ca):
+    ci = empty(len(gc))
+    a  = empty(len(gc))
+    da = empty(len(gc))
+    for i in range(len(gc)):
+        ci[i],a[i],da[i] = a_ci_seg_deriv_kernel(vmax, j, km, r_day, gamma, gc[i], ca[i])
+    return ci, a, da
+
+# cell of the sorted axis ax that x is in, and the weight of its upper node;
+#     x outside the axis is extrapolated from the end cell
+@njit(cache=True)
+def axis_cell_kernel(ax, x):
+    i = searchsorted(ax, x, side="right") - 1
+    i = min(max(i, 0), len(ax)-2)
+    return i, (x-ax[i]) / (ax[i+1]-ax[i])
+
+# multilinear interpolation at one point of a table on a 4-D grid, the last
+#     axis of the table holds the values, which are interpolated together into
+#     row i of out; the 16 corners of the cell around the point are summed
+#     with their weights
+@njit(cache=True)
+def table_fill_kernel(table, ax0, ax1, ax2, ax3, x0, x1, x2, x3, out, i):
+    i0,w0 = axis_cell_kernel(ax0, x0)
+    i1,w1 = axis_cell_kernel(ax1, x1)
+    i2,w2 = axis_cell_kernel(ax2, x2)
+    i3,w3 = axis_cell_kernel(ax3, x3)
+    for k in range(out.shape[1]):
+        out[i,k] = 0.0
+    for corner in range(16):
+        n0 = (corner>>3) & 1
+        n1 = (corner>>2) & 1
+        n2 = (corner>>1) & 1
+        n3 = corner & 1
+        f  = (w0 if n0 else 1.0-w0) * (w1 if n1 else 1.0-w1) * (w2 if n2 else 1.0-w2) * (w3 if n3 else 1.0-w3)
+        for k in range(out.shape[1]):
+            out[i,k] += f * table[i0+n0, i1+n1, i2+n2, i3+n3, k]
+
+@njit(cache=True)
+def table_kernel(table, ax0, ax1, ax2, ax3, x0, x1, x2, x3):
+    out = empty((1, table.shape[4]))
+    table_fill_kernel(table, ax0, ax1, ax2, ax3, x0, x1, x2, x3, out, 0)
+    return out[0]
+
+# table_kernel over arrays of points, returns the (n, values) array
+@njit(cache=True)
+def table_grid_kernel(table, ax0, ax1, ax2, ax3, x0, x1, x2, x3):
+    out = empty((len(x0), table.shape[4]))
+    for i in range(len(x0)):
+        table_fill_kernel(table, ax0, ax1, ax2, ax3, x0[i], x1[i], x2[i], x3[i], out, i)
+    return out
+
+# p_rhiz_deriv_kernel and p_layers_deriv_kernel over an array of flows in one
+#     call, p_up, dp_up and d2p_up are arrays of the same length as flow
+@njit(cache=True)
+def p_rhiz_deriv_grid_kernel(flow, p_soil, p_ssat, c_ssat, b_ssat, k_rhiz, n_shell):
+    p   = empty(len(flow))
+    dp  = empty(len(flow))
+    d2p = empty(len(flow))
+    for i in range(len(flow)):
+        p[i],dp[i],d2p[i] = p_rhiz_deriv_kernel(flow[i], p_soil, p_ssat, c_ssat, b_ssat, k_rhiz, n_shell)
+    return p, dp, d2p
+
+@njit(cache=True)
+def p_layers_deriv_grid_kernel(flow, p_up, dp_up, d2p_up, legacy, b, c, k, h, n_layer):
+    p   = empty(len(flow))
+    dp  = empty(len(flow))
+    d2p = empty(len(flow))
+    for i in range(len(flow)):
+        p[i],dp[i],d2p[i] = p_layers_deriv_kernel(flow[i], p_up[i], dp_up[i], d2p_up[i], legacy, b, c, k, h, n_layer)
+    return p, dp, d2p
+
+# compare the kernels with their plain python versions and with the array
+#     solvers in photosynthesis.py, returns the largest relative error
+#     the derivative kernels are compared with central differences, for the
+#     layers only below p_crit as the curve is too stiff beyond it
+def check_equivalence(n=1000, seed=0):
+    from numpy import cumsum,random,zeros
+    from scipy.interpolate import RegularGridInterpolator
+    from photosynthesis import get_ci_colimit_array,get_ci_seg_array,leaf_photosynthesis
+
+    def py(func):
+        return getattr(func, "py_func", func)
+
+    def rel(x, y):
+        return abs(x-y) / max(1.0, abs(y))
+
+    rng   = random.default_rng(seed)
+    error = {"a_ci": 0.0, "a_ci_seg": 0.0, "da_ci_seg": 0.0, "table": 0.0, "p_rhiz": 0.0, "p_layers": 0.0, "dp_rhiz": 0.0, "dp_layers": 0.0, "d2p_rhiz": 0.0, "d2p_layers": 0.0}
+    axes  = [cumsum(rng.uniform(0.5,2,m)) for m in (5,4,3,6)]
+    table = rng.uniform(-1,1,(5,4,3,6,2))
+    interp = RegularGridInterpolator(axes, table)
+    for i in range(n):
+        point = [rng.uniform(ax[0],ax[-1]) for ax in axes]
+        ref   = interp(point)[0]
+        for func in (table_kernel, py(table_kernel)):
+            out = func(table, *axes, *point)
+            error["table"] = max(error["table"], rel(out[0],ref[0]), rel(out[1],ref[1]))
+        leaf = leaf_photosynthesis(rng.uniform(20,120), rng.uniform(40,200), 2.5, rng.uniform(5,40), rng.uniform(0,2000))
+        gc   = rng.uniform(0,3)
+        ca   = rng.uniform(20,80)
+        args = (leaf.vmax, leaf.j, leaf.km, leaf.r_day, leaf.gamma, gc, ca)
+        ci   = get_ci_colimit_array(*args, leaf.adjust)[()]
+        ref  = (ci, leaf.get_a(ci))
+        for func in (a_ci_kernel, py(a_ci_kernel)):
+            out = func(*args, leaf.adjust)
+            error["a_ci"] = max(error["a_ci"], rel(out[0],ref[0]), rel(out[1],ref[1]))
+        ci   = get_ci_seg_array(*args)[()]
+        ref  = (ci, leaf.get_a_seg(ci))
+        for func in (a_ci_seg_kernel, py(a_ci_seg_kernel)):
+            out = func(*args)
+            error["a_ci_seg"] = max(error["a_ci_seg"], rel(out[0],ref[0]), rel(out[1],ref[1]))
+        dgc  = 1E-6 * max(1.0, gc)
+        d_ref = (a_ci_seg_kernel(*args[:5], gc+dgc, ca)[1] - a_ci_seg_kernel(*args[:5], gc-dgc, ca)[1]) / (2.0*dgc)
+        for func in (a_ci_seg_deriv_kernel, py(a_ci_seg_deriv_kernel)):
+            out = func(*args)
+            error["a_ci_seg"] = max(error["a_ci_seg"], rel(out[0],ref[0]), rel(out[1],ref[1]))
+            error["da_ci_seg"] = max(error["da_ci_seg"], rel(out[2],d_ref))
+        flow   = rng.uniform(0,2000)
+        p_soil = rng.uniform(0,2)
+        args   = (flow, p_soil, 0.0062, 0.476, 8.52, 5E8, 10)
+        error["p_rhiz"] = max(error["p_rhiz"], rel(p_rhiz_kernel(*args), py(p_rhiz_kernel)(*args)))
+        p,dp,d2p = p_rhiz_deriv_kernel(*args)
+        dflow = 1E-6 * max(1.0, flow)
+        d_ref = (p_rhiz_kernel(flow+dflow, *args[1:]) - p_rhiz_kernel(flow-dflow, *args[1:])) / (2.0*dflow)
+        d2_ref = (p_rhiz_deriv_kernel(flow+dflow, *args[1:])[1] - p_rhiz_deriv_kernel(flow-dflow, *args[1:])[1]) / (2.0*dflow)
+        error["p_rhiz"  ] = max(error["p_rhiz"], rel(p, p_rhiz_kernel(*args)))
+        error["dp_rhiz" ] = max(error["dp_rhiz"], rel(dp, d_ref))
+        error["d2p_rhiz"] = max(error["d2p_rhiz"], rel(d2p, d2_ref))
+        legacy = zeros(20)
+        legacy[rng.integers(0,20)] = rng.uniform(0,3)
+        args   = (flow, p_soil, legacy, rng.uniform(1,4), rng.uniform(1,10), rng.uniform(1E3,1E4), rng.uniform(0,2), 20)
+        error["p_layers"] = max(error["p_layers"], rel(p_layers_kernel(*args), py(p_layers_kernel)(*args)))
+        args_d = (args[1], 0.0, 0.0) + args[2:]
+        p,dp,d2p = p_layers_deriv_kernel(flow, *args_d)
+        d_ref  = (p_layers_kernel(flow+dflow, *args[1:]) - p_layers_kernel(flow-dflow, *args[1:])) / (2.0*dflow)
+        d2_ref = (p_layers_deriv_kernel(flow+dflow, *args_d)[1] - p_layers_deriv_kernel(flow-dflow, *args_d)[1]) / (2.0*dflow)
+        error["p_layers"] = max(error["p_layers"], rel(p, p_layers_kernel(*args)))
+        if p < args[3] * log(1000.0) ** (1.0/args[4]):
+            error["dp_layers" ] = max(error["dp_layers"], rel(dp, d_ref))
+            error["d2p_layers"] = max(error["d2p_layers"], rel(d2p, d2_ref))
+    return error
+
+if __name__ == "__main__":
+    error = check_equivalence()
+    print("JIT enabled:", JIT_ENABLED)
+    for key in error:
+        print("%-10s %.3e" % (key, error[key]))
+    assert max(error[key] for key in ("a_ci", "a_ci_seg", "table", "p_rhiz", "p_layers")) < 1E-10
+    assert max(error["da_ci_seg"], error["dp_rhiz"], error["dp_layers"], error["d2p_rhiz"], error["d2p_layers"]) < 1E-6
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+from hashlib         import sha1
+from json            import dump,load
+from multiprocessing import Pool
+from os              import makedirs,replace
+from os.path         import exists,join
+
+from numpy import asarray,broadcast_arrays,concatenate,load as load_npy,ndarray,save,zeros
+
+DRIVERS = {"d_leaf": 1.5, "ca": 40.0, "t_leaf": 25.0, "par": 1000.0}
+
+
+
+
+# driver arrays from a DataFrame or a dict of arrays or scalars, the drivers
+#     not given take the default of the get_optima_* methods
+def get_driver_arrays(drivers):
+    columns = {}
+    for key in DRIVERS:
+        if key in drivers:
+            columns[key] = asarray(drivers[key], dtype=float)
+        else:
+            columns[key] = asarray(DRIVERS[key], dtype=float)
+    arrays = broadcast_arrays(*columns.values())
+    return {key: arr.ravel() for key,arr in zip(columns, arrays)}
+
+# hash of the driver arrays, to tell runs of the same length apart
+def get_driver_hash(drivers):
+    digest = sha1()
+    for key in sorted(drivers):
+        digest.update(key.encode())
+        digest.update(asarray(drivers[key], dtype=float).tobytes())
+    return digest.hexdigest()
+
+# hash of the traits and legacy arrays of a model, i.e. of its attributes that
+#     are numbers, strings, tuples or arrays; the cached supply curve and the
+#     photosynthesis functions are left out
+def get_model_hash(model):
+    digest = sha1()
+    for key in sorted(model.__dict__):
+        value = model.__dict__[key]
+        if key.startswith("supply_") or callable(value):
+            continue
+        digest.update(key.encode())
+        if isinstance(value, ndarray):
+            digest.update(asarray(value, dtype=float).tobytes())
+        elif isinstance(value, float):
+            digest.update(repr(float(value)).encode())
+        else:
+            digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+# optima of one chunk of drivers, run in a worker process
+#     returns the chunk index and a (n,3) array of a_opt, e_opt and p_opt
+def get_optima_chunk(task):
+    model,criterion,index,drivers,kwargs = task
+    func   = getattr(model, "get_optima_"+criterion)
+    n      = len(drivers["par"])
+    result = zeros((n,3))
+    for i in range(n):
+        result[i] = func(d_leaf=drivers["d_leaf"][i],
+                         ca=drivers["ca"][i],
+                         t_leaf=drivers["t_leaf"][i],
+                         par=drivers["par"][i],
+                         **kwargs)
+    return index, result
+
+def get_chunk_file(checkpoint, index):
+    return join(checkpoint, "chunk_%06d.npy" % index)
+
+# check that a checkpoint folder belongs to the same run, or start it
+def set_checkpoint(checkpoint, meta):
+    makedirs(checkpoint, exist_ok=True)
+    filename = join(checkpoint, "meta.json")
+    if exists(filename):
+        with open(filename) as f:
+            saved = load(f)
+        if saved!=meta:
+            raise ValueError("checkpoint %s was written for %s, not %s" % (checkpoint, saved, meta))
+    else:
+        with open(filename, "w") as f:
+            dump(meta, f)
+
+# optima of a criterion over a series of drivers, e.g. the half-hours of a
+#     site-year, returns the a_opt, e_opt and p_opt arrays in input order
+#     drivers is a DataFrame or a dict with d_leaf, ca, t_leaf and par columns,
+#     kwargs go to the get_optima_* method, e.g. lambd or rtol
+#     the chunks are solved by a pool of processes; with a checkpoint folder
+#     each finished chunk is saved there, and a run that was stopped skips the
+#     chunks already saved when called again with the same arguments, model
+#     traits and drivers
+def get_optima_series(model, criterion, drivers, processes=None, chunk_size=500, checkpoint=None, **kwargs):
+    drivers = get_driver_arrays(drivers)
+    n       = len(drivers["par"])
+    n_chunk = (n + chunk_size - 1) // chunk_size
+    # solve e_crit once here, so that the workers get it with the model
+    model.get_e_crit()
+    results = [None] * n_chunk
+    if checkpoint is not None:
+        set_checkpoint(checkpoint, {"criterion" : criterion,
+                                    "n"         : n,
+                                    "chunk_size": chunk_size,
+                                    "kwargs"    : kwargs,
+                                    "drivers"   : get_driver_hash(drivers),
+                                    "model"     : get_model_hash(model)})
+        for index in range(n_chunk):
+            if exists(get_chunk_file(checkpoint, index)):
+                results[index] = load_npy(get_chunk_file(checkpoint, index))
+    tasks = []
+    for index in range(n_chunk):
+        if results[index] is None:
+            chunk = slice(index*chunk_size, (index+1)*chunk_size)
+            tasks.append( (model, criterion, index, {key: drivers[key][chunk] for key in drivers}, kwargs) )
+    def collect(index, result):
+        results[index] = result
+        if checkpoint is not None:
+            filename = get_chunk_file(checkpoint, index)
+            save(filename+".tmp.npy", result)
+            replace(filename+".tmp.npy", filename)
+    if processes==1 or len(tasks)<2:
+        for task in tasks:
+            collect(*get_optima_chunk(task))
+    else:
+        with Pool(processes) as pool:
+            for index,result in pool.imap_unordered(get_optima_chunk, tasks):
+                collect(index, result)
+    if n==0:
+        return zeros(0), zeros(0), zeros(0)
+    result = concatenate(results)
+    return result[:,0], result[:,1], result[:,2]
+
+
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+    from numpy import random
+    from gain_risk_model_aspen import gain_risk_model_aspen
+
+    rng     = random.default_rng(0)
+    n       = 2000
+    drivers = {"d_leaf": rng.uniform(0.5, 3.0, n),
+               "ca"    : rng.uniform(30.0, 50.0, n),
+               "t_leaf": rng.uniform(10.0, 35.0, n),
+               "par"   : rng.uniform(100.0, 2000.0, n)}
+    model   = gain_risk_model_aspen()
+    for processes in [1, None]:
+        start = perf_counter()
+        a_opt,e_opt,p_opt = get_optima_series(model, "wang", drivers, processes=processes, chunk_size=100)
+        print("processes=%s: %.2f s" % (processes, perf_counter()-start))
+    for i in [0, n//2, n-1]:
+        print(a_opt[i], e_opt[i], p_opt[i], model.get_optima_wang(drivers["d_leaf"][i], drivers["ca"][i], drivers["t_leaf"][i], drivers["par"][i]))
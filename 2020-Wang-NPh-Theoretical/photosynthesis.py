@@ -5,7 +5,12 @@ Created on Tue Nov  6 08:57:45 2018
 @author: Yujie
 """
 
+from functools import lru_cache
+
 from pylab import array,exp,sqrt
+from numpy import absolute,asarray,broadcast_arrays,clip,errstate,maximum,minimum,nan,where
+
+from jit_kernels import JIT_ENABLED,a_ci_grid_kernel,a_ci_kernel,a_ci_seg_deriv_grid_kernel,a_ci_seg_deriv_kernel,a_ci_seg_kernel
 
 # get one-point measurement Vcmax
 def GetOnePointVcmax(ci, an, tem, gamma=2.5):
@@ -28,6 +33,33 @@ def GetOnePointVcmax(ci, an, tem, gamma=2.5):
     return v25
 
 
+# invert one-point measurements to v25, exact and for whole arrays of (ci, an, tem)
+#     at a fixed temperature an = v25 * (fv*(ci-gamma)/(ci+km) - fr), where fv and fr
+#     are vmax and r_day per unit v25; nan where an cannot be rubisco limited
+def GetOnePointVcmaxArray(ci, an, tem, gamma=2.5):
+    ci,an,tem,gamma = broadcast_float(ci,an,tem,gamma)
+    fv = GetPhotosyntheticVcmax(1.0,tem)
+    fr = get_r_day(1.0,tem)
+    km = get_km(tem)
+    slope = fv * (ci-gamma) / (ci+km) - fr
+    with errstate(divide="ignore", invalid="ignore"):
+        v25 = where(slope>0, an/slope, nan)
+    return v25
+
+# invert one-point measurements to j25 given v25 for r_day, using
+#     an + r_day = j * (ci-gamma) / (4*(ci+2*gamma)) and inverting GetPhotosyntheticJ,
+#     jmax = j * (0.3*light-0.9*j) / (0.3*light-j); nan where j >= 0.3*light
+def GetOnePointJmaxArray(ci, an, tem, v25, par=1000.0, gamma=2.5):
+    ci,an,tem,v25,par,gamma = broadcast_float(ci,an,tem,v25,par,gamma)
+    r_day = get_r_day(v25,tem)
+    fj    = GetPhotosyntheticJmax(1.0,tem)
+    with errstate(divide="ignore", invalid="ignore"):
+        j    = 4.0 * (an+r_day) * (ci+2*gamma) / (ci-gamma)
+        jmax = j * (0.3*par-0.9*j) / (0.3*par-j)
+        j25  = where((ci>gamma) & (j>0) & (j<0.3*par), jmax/fj, nan)
+    return j25
+
+
 # calculate j from light
 def GetPhotosyntheticJ(jmax, light):
     a = 0.9
@@ -95,93 +127,290 @@ def get_a_seg(v25,j25,gamma,ci,tem,par):
 
 # get ci and Anet from gc and ca
 def get_a_ci(v25,j25,gamma,gc,ca,tem,par):
-    tar_p  = 0.0
-    tar_a  = 0.0
-    max_p  = ca
-    min_p  = gamma
-    adjust = 0.98
-    r_day  = v25 * 0.01 *  2.0**(0.1*(tem-25.0)) / (1.0+exp(1.3*(tem-55.0)))
-    while(1):
-        tar_p = 0.5 * (max_p+min_p)
-        vmax = GetPhotosyntheticVcmax(v25,tem)
-        jmax = GetPhotosyntheticJmax(j25,tem)
-        j = GetPhotosyntheticJ(jmax,par)
-        kc = 41.01637 * 2.1**(0.1*(tem-25.0))
-        ko = 28201.92 * 1.2**(0.1*(tem-25.0))
-        km = kc * (1.0+21000.0/ko)
-        aj = j * (tar_p-gamma) / (4.0*(tar_p+2*gamma))
-        ac = vmax * (tar_p-gamma) / (tar_p+km)
-        af = (aj + ac - sqrt((aj+ac)**2.0 - 4*adjust*aj*ac) ) / adjust * 0.5
-        af = af - r_day
-        #af = min(aj,ac) - r_day
-        tmp_g = af / (ca-tar_p)
-        if(abs(tmp_g-gc)/gc < 1E-12):
-            tar_a = af
-            break
-        elif(tmp_g<gc):
-            min_p = tar_p
-        else:
-            max_p = tar_p
-        if(abs(max_p-min_p) < 1E-12):
-            tar_a = af
-            break
-    return [tar_p, tar_a]
+    leaf = get_leaf_photosynthesis(v25,j25,gamma,tem,par)
+    return leaf.get_a_ci(gc,ca)
 
 def get_a_ci_seg(v25,j25,gamma,gc,ca,tem,par):
-    tar_p  = 0.0
-    tar_a  = 0.0
-    max_p  = ca
-    min_p  = gamma
-    r_day  = v25 * 0.01 *  2.0**(0.1*(tem-25.0)) / (1.0+exp(1.3*(tem-55.0)))
-    while(1):
-        tar_p = 0.5 * (max_p+min_p)
-        vmax = GetPhotosyntheticVcmax(v25,tem)
-        jmax = GetPhotosyntheticJmax(j25,tem)
-        j = GetPhotosyntheticJ(jmax,par)
-        kc = 41.01637 * 2.1**(0.1*(tem-25.0))
-        ko = 28201.92 * 1.2**(0.1*(tem-25.0))
-        km = kc * (1.0+21000.0/ko)
-        aj = j * (tar_p-gamma) / (4.0*(tar_p+2*gamma))
-        ac = vmax * (tar_p-gamma) / (tar_p+km)
-        af = min(aj,ac)
-        af = af - r_day
-        #af = min(aj,ac) - r_day
-        tmp_g = af / (ca-tar_p)
-        if(abs(tmp_g-gc)/gc < 1E-12):
-            tar_a = af
-            break
-        elif(tmp_g<gc):
-            min_p = tar_p
-        else:
-            max_p = tar_p
-        if(abs(max_p-min_p) < 1E-12):
-            tar_a = af
-            break
-    return [tar_p, tar_a]
+    leaf = get_leaf_photosynthesis(v25,j25,gamma,tem,par)
+    return leaf.get_a_ci_seg(gc,ca)
+
+# get ci, Anet and dAnet/dgc from gc and ca, segmented
+def get_a_ci_seg_deriv(v25,j25,gamma,gc,ca,tem,par):
+    leaf = get_leaf_photosynthesis(v25,j25,gamma,tem,par)
+    return leaf.get_a_ci_seg_deriv(gc,ca)
+
+# get_a_ci and get_a_ci_seg_deriv at an array of gc (or ca) for scalar traits
+#     and drivers, through the cached leaf state
+def get_a_ci_grid(v25,j25,gamma,gc,ca,tem,par):
+    leaf = get_leaf_photosynthesis(v25,j25,gamma,tem,par)
+    return leaf.get_a_ci_array(gc,ca)
+
+def get_a_ci_seg_deriv_grid(v25,j25,gamma,gc,ca,tem,par):
+    leaf = get_leaf_photosynthesis(v25,j25,gamma,tem,par)
+    return leaf.get_a_ci_seg_deriv_array(gc,ca)
 
+# leaf photosynthetic state, the terms that do not change with ci are computed
+#     once and reused for every gc, ca or ci
+class leaf_photosynthesis():
+    def __init__(self, v25, j25, gamma=2.5, tem=25.0, par=1000.0):
+        self.v25    = v25
+        self.j25    = j25
+        self.gamma  = gamma
+        self.tem    = tem
+        self.par    = par
+        self.adjust = 0.98
+        self.r_day  = get_r_day(v25,tem)
+        self.vmax   = GetPhotosyntheticVcmax(v25,tem)
+        self.jmax   = GetPhotosyntheticJmax(j25,tem)
+        self.j      = GetPhotosyntheticJ(self.jmax,par)
+        self.km     = get_km(tem)
+    
+    # colimited Anet at given ci, ci may be an array
+    def get_a(self, ci):
+        gamma  = self.gamma
+        adjust = self.adjust
+        aj = self.j * (ci-gamma) / (4.0*(ci+2*gamma))
+        ac = self.vmax * (ci-gamma) / (ci+self.km)
+        af = (aj + ac - sqrt((aj+ac)**2.0 - 4*adjust*aj*ac) ) / adjust * 0.5
+        return af - self.r_day
+    
+    # segmented Anet at given ci, ci may be an array
+    def get_a_seg(self, ci):
+        gamma = self.gamma
+        aj = self.j * (ci-gamma) / (4.0*(ci+2*gamma))
+        ac = self.vmax * (ci-gamma) / (ci+self.km)
+        return minimum(aj,ac) - self.r_day
+    
+    # ci and colimited Anet from gc and ca, see a_ci_kernel in jit_kernels.py
+    def get_a_ci(self, gc, ca):
+        return list(a_ci_kernel(self.vmax, self.j, self.km, self.r_day, self.gamma, gc, ca, self.adjust))
+    
+    # ci and segmented Anet from gc and ca, see a_ci_seg_kernel
+    def get_a_ci_seg(self, gc, ca):
+        return list(a_ci_seg_kernel(self.vmax, self.j, self.km, self.r_day, self.gamma, gc, ca))
+    
+    # ci, segmented Anet and dAnet/dgc from gc and ca, see a_ci_seg_deriv_kernel
+    def get_a_ci_seg_deriv(self, gc, ca):
+        return list(a_ci_seg_deriv_kernel(self.vmax, self.j, self.km, self.r_day, self.gamma, gc, ca))
+    
+    # array versions of get_a_ci and get_a_ci_seg, gc and ca are broadcast
+    #     get_a_ci_array loops over the compiled kernel if numba is installed
+    def get_a_ci_array(self, gc, ca):
+        gc,ca = broadcast_float(gc,ca)
+        if JIT_ENABLED:
+            tar_p,tar_a = a_ci_grid_kernel(self.vmax, self.j, self.km, self.r_day, self.gamma, gc.ravel(), ca.ravel(), self.adjust)
+            return tar_p.reshape(gc.shape), tar_a.reshape(gc.shape)
+        tar_p = get_ci_colimit_array(self.vmax, self.j, self.km, self.r_day, self.gamma, gc, ca, self.adjust)
+        return tar_p, self.get_a(tar_p)
+    
+    def get_a_ci_seg_array(self, gc, ca):
+        gc,ca = broadcast_float(gc,ca)
+        tar_p = get_ci_seg_array(self.vmax, self.j, self.km, self.r_day, self.gamma, gc, ca)
+        return tar_p, self.get_a_seg(tar_p)
+    
+    # array version of get_a_ci_seg_deriv, gc and ca are broadcast
+    def get_a_ci_seg_deriv_array(self, gc, ca):
+        gc,ca = broadcast_float(gc,ca)
+        if JIT_ENABLED:
+            result = a_ci_seg_deriv_grid_kernel(self.vmax, self.j, self.km, self.r_day, self.gamma, gc.ravel(), ca.ravel())
+            return tuple(x.reshape(gc.shape) for x in result)
+        return get_a_ci_seg_deriv_array(self.v25, self.j25, self.gamma, gc, ca, self.tem, self.par)
+
+# cached leaf photosynthetic states, keyed on the scalar drivers
+#     the cache keeps the LEAF_CACHE_SIZE most recently used states
+LEAF_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=LEAF_CACHE_SIZE)
+def get_leaf_photosynthesis(v25, j25, gamma, tem, par):
+    return leaf_photosynthesis(v25, j25, gamma, tem, par)
+
+# hits, misses, size and hit rate of the leaf state cache
+def get_leaf_cache_info():
+    info  = get_leaf_photosynthesis.cache_info()
+    calls = info.hits + info.misses
+    return {"hits"    : info.hits,
+            "misses"  : info.misses,
+            "size"    : info.currsize,
+            "maxsize" : info.maxsize,
+            "hit_rate": info.hits/calls if calls>0 else 0.0}
+
+def clear_leaf_cache():
+    get_leaf_photosynthesis.cache_clear()
+
+# co2 compensation point with day respiration, where ac = r_day, i.e.
+#     ci = (vmax*gamma + r_day*km) / (vmax - r_day)
+#     limited to [gamma,80] as the bisection used to be, par is not used
 def get_gamma_nostar(v25,gamma,tem,par):
-    tar_p  = 0.0
-    max_p  = 80.0
-    min_p  = gamma
-    r_day  = v25 * 0.01 *  2.0**(0.1*(tem-25.0)) / (1.0+exp(1.3*(tem-55.0)))
-    while(1):
-        tar_p = 0.5 * (max_p+min_p)
-        vmax = GetPhotosyntheticVcmax(v25,tem)
-        kc = 41.01637 * 2.1**(0.1*(tem-25.0))
-        ko = 28201.92 * 1.2**(0.1*(tem-25.0))
-        km = kc * (1.0+21000.0/ko)
-        ac = vmax * (tar_p-gamma) / (tar_p+km)
-        af = ac - r_day
-        if abs(af)<1E-12:
-            break
-        elif af>0:
-            max_p = tar_p
-        else:
-            min_p = tar_p
-        if(abs(max_p-min_p) < 1E-12):
+    r_day = get_r_day(v25,tem)
+    vmax  = GetPhotosyntheticVcmax(v25,tem)
+    km    = get_km(tem)
+    if vmax>r_day:
+        tar_p = (vmax*gamma + r_day*km) / (vmax-r_day)
+    else:
+        tar_p = 80.0
+    return min(max(tar_p,gamma), 80.0)
+
+# array version of get_gamma_nostar, v25, gamma and tem are broadcast
+def get_gamma_nostar_array(v25,gamma,tem):
+    v25,gamma,tem = broadcast_float(v25,gamma,tem)
+    r_day = get_r_day(v25,tem)
+    vmax  = GetPhotosyntheticVcmax(v25,tem)
+    km    = get_km(tem)
+    with errstate(divide="ignore", invalid="ignore"):
+        tar_p = where(vmax>r_day, (vmax*gamma + r_day*km) / (vmax-r_day), 80.0)
+    return clip(tar_p, gamma, 80.0)
+
+# day respiration from v25 and temperature
+def get_r_day(v25, tem):
+    r_day = v25 * 0.01 *  2.0**(0.1*(tem-25.0)) / (1.0+exp(1.3*(tem-55.0)))
+    return r_day
+
+# michaelis-menten constant of rubisco from temperature
+def get_km(tem):
+    kc = 41.01637 * 2.1**(0.1*(tem-25.0))
+    ko = 28201.92 * 1.2**(0.1*(tem-25.0))
+    km = kc * (1.0+21000.0/ko)
+    return km
+
+# broadcast the inputs to float arrays of a common shape
+def broadcast_float(*args):
+    return broadcast_arrays(*[asarray(arg, dtype=float) for arg in args])
+
+# array version of GetPhotosyntheticJ, jmax and light are broadcast
+def GetPhotosyntheticJArray(jmax, light):
+    jmax,light = broadcast_float(jmax, light)
+    return GetPhotosyntheticJ(jmax, light)
+
+# array version of GetPhotosyntheticJmax, jmax25 and tem are broadcast
+def GetPhotosyntheticJmaxArray(jmax25, tem):
+    jmax25,tem = broadcast_float(jmax25, tem)
+    return GetPhotosyntheticJmax(jmax25, tem)
+
+# array version of GetPhotosyntheticVcmax, vcmax25 and tem are broadcast
+def GetPhotosyntheticVcmaxArray(vcmax25, tem):
+    vcmax25,tem = broadcast_float(vcmax25, tem)
+    return GetPhotosyntheticVcmax(vcmax25, tem)
+
+# array version of get_a, all the inputs are broadcast
+def get_a_array(v25,j25,gamma,ci,tem,par):
+    v25,j25,gamma,ci,tem,par = broadcast_float(v25,j25,gamma,ci,tem,par)
+    adjust = 0.98
+    r_day = get_r_day(v25,tem)
+    vmax  = GetPhotosyntheticVcmax(v25,tem)
+    jmax  = GetPhotosyntheticJmax(j25,tem)
+    j     = GetPhotosyntheticJ(jmax,par)
+    km    = get_km(tem)
+    aj = j * (ci-gamma) / (4.0*(ci+2*gamma))
+    ac = vmax * (ci-gamma) / (ci+km)
+    af = (aj + ac - sqrt((aj+ac)**2.0 - 4*adjust*aj*ac) ) / adjust * 0.5
+    af = af - r_day
+    return af
+
+# array version of get_a_seg, all the inputs are broadcast
+def get_a_seg_array(v25,j25,gamma,ci,tem,par):
+    v25,j25,gamma,ci,tem,par = broadcast_float(v25,j25,gamma,ci,tem,par)
+    r_day = get_r_day(v25,tem)
+    vmax  = GetPhotosyntheticVcmax(v25,tem)
+    jmax  = GetPhotosyntheticJmax(j25,tem)
+    j     = GetPhotosyntheticJ(jmax,par)
+    km    = get_km(tem)
+    aj = j * (ci-gamma) / (4.0*(ci+2*gamma))
+    ac = vmax * (ci-gamma) / (ci+km)
+    af = minimum(aj,ac)
+    af = af - r_day
+    return af
+
+# ci_quadratic_kernel of jit_kernels.py for arrays
+def get_ci_quadratic_array(v, k, gamma, r_day, gc, ca):
+    qa = gc
+    qb = v - r_day - gc*(ca-k)
+    qc = -(v*gamma + r_day*k + gc*ca*k)
+    qd = sqrt(qb*qb - 4.0*qa*qc)
+    with errstate(divide="ignore", invalid="ignore"):
+        ci = where(qb>=0, -2.0*qc/(qb+qd), (qd-qb)/(2.0*qa))
+    ci = where((qb+qd>0) & ((qb>=0) | (qa>0)), ci, ca)
+    return clip(ci, gamma, ca)
+
+# ci_seg_kernel of jit_kernels.py for arrays
+def get_ci_seg_array(vmax, j, km, r_day, gamma, gc, ca):
+    ci_c = get_ci_quadratic_array(vmax, km, gamma, r_day, gc, ca)
+    ci_j = get_ci_quadratic_array(0.25*j, 2.0*gamma, gamma, r_day, gc, ca)
+    return maximum(ci_c, ci_j)
+
+# a_ci_kernel of jit_kernels.py for arrays, newton steps are taken on all the elements
+#     until every element has converged
+def get_ci_colimit_array(vmax, j, km, r_day, gamma, gc, ca, adjust=0.98):
+    min_p = get_ci_seg_array(vmax, j, km, r_day, gamma, gc, ca)
+    max_p = ca + 0.0*min_p
+    tar_p = min_p
+    for i in range(50):
+        aj  = j * (tar_p-gamma) / (4.0*(tar_p+2*gamma))
+        ac  = vmax * (tar_p-gamma) / (tar_p+km)
+        daj = j * 0.75 * gamma / (tar_p+2*gamma)**2
+        dac = vmax * (km+gamma) / (tar_p+km)**2
+        s   = aj + ac
+        d   = sqrt(maximum(s*s - 4*adjust*aj*ac, 0.0))
+        af  = (s - d) / adjust * 0.5
+        f   = af - r_day - gc*(ca-tar_p)
+        max_p = where(f>0, tar_p, max_p)
+        min_p = where(f>0, min_p, tar_p)
+        with errstate(divide="ignore", invalid="ignore"):
+            da    = where(d>0, (daj + dac - (s*(daj+dac) - 2*adjust*(daj*ac+aj*dac))/d) / adjust * 0.5, minimum(daj,dac))
+            new_p = where(da+gc>0, tar_p - f/(da+gc), tar_p)
+        new_p = where((new_p>=min_p) & (new_p<=max_p), new_p, 0.5*(max_p+min_p))
+        done  = (absolute(new_p-tar_p) < 1E-12*maximum(1.0,tar_p)) | (max_p-min_p < 1E-12)
+        tar_p = new_p
+        if done.all():
             break
     return tar_p
 
+# array version of get_a_ci, returns ci and Anet arrays
+def get_a_ci_array(v25,j25,gamma,gc,ca,tem,par):
+    v25,j25,gamma,gc,ca,tem,par = broadcast_float(v25,j25,gamma,gc,ca,tem,par)
+    adjust = 0.98
+    r_day  = get_r_day(v25,tem)
+    vmax   = GetPhotosyntheticVcmax(v25,tem)
+    jmax   = GetPhotosyntheticJmax(j25,tem)
+    j      = GetPhotosyntheticJ(jmax,par)
+    km     = get_km(tem)
+    tar_p  = get_ci_colimit_array(vmax, j, km, r_day, gamma, gc, ca, adjust)
+    aj = j * (tar_p-gamma) / (4.0*(tar_p+2*gamma))
+    ac = vmax * (tar_p-gamma) / (tar_p+km)
+    af = (aj + ac - sqrt(maximum((aj+ac)**2.0 - 4*adjust*aj*ac, 0.0)) ) / adjust * 0.5
+    tar_a = af - r_day
+    return tar_p, tar_a
+
+# array version of get_a_ci_seg, returns ci and Anet arrays
+def get_a_ci_seg_array(v25,j25,gamma,gc,ca,tem,par):
+    v25,j25,gamma,gc,ca,tem,par = broadcast_float(v25,j25,gamma,gc,ca,tem,par)
+    r_day  = get_r_day(v25,tem)
+    vmax   = GetPhotosyntheticVcmax(v25,tem)
+    jmax   = GetPhotosyntheticJmax(j25,tem)
+    j      = GetPhotosyntheticJ(jmax,par)
+    km     = get_km(tem)
+    tar_p  = get_ci_seg_array(vmax, j, km, r_day, gamma, gc, ca)
+    aj = j * (tar_p-gamma) / (4.0*(tar_p+2*gamma))
+    ac = vmax * (tar_p-gamma) / (tar_p+km)
+    tar_a = minimum(aj,ac) - r_day
+    return tar_p, tar_a
+
+# array version of get_a_ci_seg_deriv, returns ci, Anet and dAnet/dgc arrays
+def get_a_ci_seg_deriv_array(v25,j25,gamma,gc,ca,tem,par):
+    v25,j25,gamma,gc,ca,tem,par = broadcast_float(v25,j25,gamma,gc,ca,tem,par)
+    r_day  = get_r_day(v25,tem)
+    vmax   = GetPhotosyntheticVcmax(v25,tem)
+    jmax   = GetPhotosyntheticJmax(j25,tem)
+    j      = GetPhotosyntheticJ(jmax,par)
+    km     = get_km(tem)
+    tar_p  = get_ci_seg_array(vmax, j, km, r_day, gamma, gc, ca)
+    aj = j * (tar_p-gamma) / (4.0*(tar_p+2*gamma))
+    ac = vmax * (tar_p-gamma) / (tar_p+km)
+    tar_a = minimum(aj,ac) - r_day
+    da = where(aj<ac, j * 0.75 * gamma / (tar_p+2*gamma)**2, vmax * (km+gamma) / (tar_p+km)**2)
+    with errstate(divide="ignore", invalid="ignore"):
+        tar_d = where((tar_p<ca) & (tar_p>gamma), da * (ca-tar_p) / (da+gc), 0.0)
+    return tar_p, tar_a, tar_d
+
 def residual_vjgamma(p,x,y,t):
     v25,j25,gamma = p
     a_list = []
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+from os      import makedirs
+from os.path import join
+
+from numpy import array,asarray,broadcast_arrays,clip,linspace,load,meshgrid,nan,random,save,savez,searchsorted,stack
+from scipy.interpolate import RegularGridInterpolator
+
+from jit_kernels    import JIT_ENABLED,table_grid_kernel,table_kernel
+from photosynthesis import broadcast_float,get_a_ci,get_a_ci_array,get_a_ci_grid,get_a_ci_seg,get_a_ci_seg_array,get_a_ci_seg_deriv,get_a_ci_seg_deriv_array,get_a_ci_seg_deriv_grid
+
+
+
+
+# tabulated ci and Anet on a (gc, ca, tem, par) grid for given v25, j25 and gamma
+#     the colimited (get_a_ci) and segmented (get_a_ci_seg) solutions are both
+#     stored, with the segmented dAnet/dgc (get_a_ci_seg_deriv), and served by
+#     multilinear interpolation from table_kernel in jit_kernels.py, or by
+#     cubic interpolation from scipy
+#     the table is not faster than the exact solvers, which are closed form
+#     for the segmented a and take a few newton steps for the colimited a; a
+#     multilinear lookup costs about as much as an uncached exact solve with
+#     numba and several times more without it, arrays of points are bound by
+#     the memory reads of the 16 corners, and cubic lookups cost far more
+#     what the table gives is a fixed surface of known error, e.g. one that is
+#     shared between runs, not a speed-up of the gain_risk models
+#     the get_a_ci* methods take the same arguments as the functions in
+#     photosynthesis.py, and fall back to them outside the grid or for other traits,
+#     so that a table can replace them in the gain_risk models:
+#         model.get_a_ci                = table.get_a_ci
+#         model.get_a_ci_seg_deriv      = table.get_a_ci_seg_deriv
+#         model.get_a_ci_grid           = table.get_a_ci_grid
+#         model.get_a_ci_seg_deriv_grid = table.get_a_ci_seg_deriv_grid
+class a_ci_table():
+    def __init__(self,
+                 v25=61.74,
+                 j25=111.13,
+                 gamma=2.5,
+                 list_gc=linspace(0.0, 5.0, 101),
+                 list_ca=linspace(20.0, 100.0, 9),
+                 list_tem=linspace(0.0, 45.0, 16),
+                 list_par=linspace(0.0, 2000.0, 21),
+                 method="linear",
+                 n_check=2000,
+                 build=True):
+        self.v25    = v25
+        self.j25    = j25
+        self.gamma  = gamma
+        self.axes   = [array(list_gc , dtype=float),
+                       array(list_ca , dtype=float),
+                       array(list_tem, dtype=float),
+                       array(list_par, dtype=float)]
+        self.method = method
+        self.table  = None
+        self.max_error = None
+        if build:
+            self.build()
+            self.max_error = self.get_max_error(n_check)
+
+    # solve the table, the last axis is [ci, a, ci_seg, a_seg, da_seg]
+    def build(self):
+        gc,ca,tem,par = meshgrid(*self.axes, indexing="ij")
+        ci,a         = get_a_ci_array(self.v25, self.j25, self.gamma, gc, ca, tem, par)
+        ci_seg,a_seg,da_seg = get_a_ci_seg_deriv_array(self.v25, self.j25, self.gamma, gc, ca, tem, par)
+        self.table = stack([ci, a, ci_seg, a_seg, da_seg], axis=-1)
+        self.set_interpolator()
+
+    # the table as a plain array for the kernels, a view if it is memory-mapped,
+    #     the grid bounds as floats for covers, and the scipy interpolator if
+    #     the method is not linear
+    def set_interpolator(self):
+        self.data   = asarray(self.table)
+        self.bounds = [(float(ax[0]), float(ax[-1])) for ax in self.axes]
+        if self.method=="linear":
+            self.interp = None
+        else:
+            self.interp = RegularGridInterpolator(self.axes,
+                                                  self.table,
+                                                  method=self.method,
+                                                  bounds_error=False,
+                                                  fill_value=nan)
+
+    # interpolated [ci, a, ci_seg, a_seg, da_seg] at a point
+    def get_table_point(self, gc, ca, tem, par):
+        if self.interp is None:
+            return table_kernel(self.data, *self.axes, gc, ca, tem, par)
+        return self.interp([gc, ca, tem, par])[0]
+
+    # interpolated [ci, a, ci_seg, a_seg, da_seg] at arrays of gc, ca, tem and par
+    #     the linear lookup loops over table_kernel if numba is installed
+    def get_table_array(self, gc, ca, tem, par):
+        gc,ca,tem,par = broadcast_float(gc, ca, tem, par)
+        if self.interp is not None:
+            return self.interp(stack([gc, ca, tem, par], axis=-1))
+        if JIT_ENABLED:
+            result = table_grid_kernel(self.data, *self.axes, gc.ravel(), ca.ravel(), tem.ravel(), par.ravel())
+            return result.reshape(gc.shape + (-1,))
+        return get_table_lookup_array(self.data, self.axes, (gc, ca, tem, par))
+
+    # maximum absolute error of the interpolated a and a_seg, from n random
+    #     points inside the grid compared with the exact solutions
+    def get_max_error(self, n=2000, seed=0):
+        rng = random.default_rng(seed)
+        gc,ca,tem,par = [rng.uniform(ax[0], ax[-1], n) for ax in self.axes]
+        result   = self.get_table_array(gc, ca, tem, par)
+        ci,a     = get_a_ci_array    (self.v25, self.j25, self.gamma, gc, ca, tem, par)
+        ci,a_seg = get_a_ci_seg_array(self.v25, self.j25, self.gamma, gc, ca, tem, par)
+        return {"a"    : abs(result[:,1]-a    ).max(),
+                "a_seg": abs(result[:,3]-a_seg).max()}
+
+    # whether the call may be served by the table
+    def covers(self, v25, j25, gamma, gc, ca, tem, par):
+        if v25!=self.v25 or j25!=self.j25 or gamma!=self.gamma:
+            return False
+        (gc_0,gc_1),(ca_0,ca_1),(tem_0,tem_1),(par_0,par_1) = self.bounds
+        return gc_0<=gc<=gc_1 and ca_0<=ca<=ca_1 and tem_0<=tem<=tem_1 and par_0<=par<=par_1
+
+    def get_a_ci(self, v25, j25, gamma, gc, ca, tem, par):
+        if not self.covers(v25, j25, gamma, gc, ca, tem, par):
+            return get_a_ci(v25, j25, gamma, gc, ca, tem, par)
+        result = self.get_table_point(gc, ca, tem, par)
+        return [result[0], result[1]]
+
+    def get_a_ci_seg(self, v25, j25, gamma, gc, ca, tem, par):
+        if not self.covers(v25, j25, gamma, gc, ca, tem, par):
+            return get_a_ci_seg(v25, j25, gamma, gc, ca, tem, par)
+        result = self.get_table_point(gc, ca, tem, par)
+        return [result[2], result[3]]
+
+    def get_a_ci_seg_deriv(self, v25, j25, gamma, gc, ca, tem, par):
+        if not self.covers(v25, j25, gamma, gc, ca, tem, par):
+            return get_a_ci_seg_deriv(v25, j25, gamma, gc, ca, tem, par)
+        result = self.get_table_point(gc, ca, tem, par)
+        return [result[2], result[3], result[4]]
+
+    # array versions for an array of gc (or ca), as get_a_ci_grid and
+    #     get_a_ci_seg_deriv_grid of photosynthesis.py, served by the table if
+    #     every point is inside the grid
+    def get_a_ci_grid(self, v25, j25, gamma, gc, ca, tem, par):
+        gc,ca = broadcast_arrays(asarray(gc, dtype=float), asarray(ca, dtype=float))
+        if not self.covers(v25, j25, gamma, gc.min(), ca.min(), tem, par) or not self.covers(v25, j25, gamma, gc.max(), ca.max(), tem, par):
+            return get_a_ci_grid(v25, j25, gamma, gc, ca, tem, par)
+        result = self.get_table_array(gc, ca, tem, par)
+        return result[...,0], result[...,1]
+
+    def get_a_ci_seg_deriv_grid(self, v25, j25, gamma, gc, ca, tem, par):
+        gc,ca = broadcast_arrays(asarray(gc, dtype=float), asarray(ca, dtype=float))
+        if not self.covers(v25, j25, gamma, gc.min(), ca.min(), tem, par) or not self.covers(v25, j25, gamma, gc.max(), ca.max(), tem, par):
+            return get_a_ci_seg_deriv_grid(v25, j25, gamma, gc, ca, tem, par)
+        result = self.get_table_array(gc, ca, tem, par)
+        return result[...,2], result[...,3], result[...,4]
+
+    # save the table as a .npy file that load_a_ci_table may memory-map,
+    #     and the axes and traits in a small .npz file next to it
+    def save(self, folder):
+        makedirs(folder, exist_ok=True)
+        save(join(folder, "table.npy"), self.table)
+        savez(join(folder, "axes.npz"),
+              traits=array([self.v25, self.j25, self.gamma]),
+              list_gc=self.axes[0],
+              list_ca=self.axes[1],
+              list_tem=self.axes[2],
+              list_par=self.axes[3])
+
+# table_kernel of jit_kernels.py for arrays of points, the 16 corners of the
+#     cells are gathered and weighted together
+def get_table_lookup_array(table, axes, points):
+    index  = []
+    weight = []
+    for ax,x in zip(axes, points):
+        i = clip(searchsorted(ax, x, side="right")-1, 0, len(ax)-2)
+        index.append(i)
+        weight.append( ((x-ax[i]) / (ax[i+1]-ax[i]))[...,None] )
+    result = 0.0
+    for corner in range(16):
+        nodes  = [(corner>>(3-k)) & 1 for k in range(4)]
+        factor = 1.0
+        for k in range(4):
+            factor = factor * (weight[k] if nodes[k] else 1.0-weight[k])
+        result = result + factor * table[index[0]+nodes[0], index[1]+nodes[1], index[2]+nodes[2], index[3]+nodes[3]]
+    return result
+
+# load a table saved by a_ci_table.save, memory-mapped unless mmap is False
+def load_a_ci_table(folder, method="linear", mmap=True, n_check=0):
+    axes  = load(join(folder, "axes.npz"))
+    v25,j25,gamma = [float(x) for x in axes["traits"]]
+    table = a_ci_table(v25, j25, gamma,
+                       axes["list_gc"],
+                       axes["list_ca"],
+                       axes["list_tem"],
+                       axes["list_par"],
+                       method=method,
+                       build=False)
+    table.table = load(join(folder, "table.npy"), mmap_mode="r" if mmap else None)
+    table.set_interpolator()
+    if n_check>0:
+        table.max_error = table.get_max_error(n_check)
+    return table
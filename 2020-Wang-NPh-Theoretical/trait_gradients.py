@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+from numpy          import array,isfinite,zeros
+from scipy.optimize import minimize
+
+from optima_series  import get_driver_arrays
+from photosynthesis import get_leaf_photosynthesis
+
+
+
+
+# aj - ac of the segmented photosynthesis at flow e, which is 0 at the kink
+#     where the limiting rate changes; an optimum can sit on the kink, where
+#     da/de and so the marginal jump from above to below 0
+def get_kink(model, e, d_leaf, ca, t_leaf, par):
+    leaf = get_leaf_photosynthesis(model.vmax, model.jmax, 2.5, t_leaf, par)
+    ci   = leaf.get_a_ci_seg(model.get_g(e,d_leaf), ca)[0]
+    aj   = leaf.j * (ci-leaf.gamma) / (4.0*(ci+2*leaf.gamma))
+    ac   = leaf.vmax * (ci-leaf.gamma) / (ci+leaf.km)
+    return aj - ac
+
+# optima of a criterion over a series of drivers and their derivatives with
+#     the traits, a list of attribute names, e.g. k_stem, b_leaf or c_pows
+#     the optimum e is a root of the marginal condition f(e, traits) = 0, so
+#     de/dtrait = -(df/dtrait) / (df/de); the partial derivatives are central
+#     differences at the fixed optimum, with a relative step, and need no
+#     optimizer run; an optimum on the kink of the photosynthesis moves with
+#     the kink instead, by the same rule applied to get_kink; e_crit moves
+#     with the traits by the same rule applied to p_leaf(e_crit) = p_crit, and
+#     an optimum at e_crit moves with it
+#     drivers is a DataFrame or a dict as in optima_series, and kwargs are the
+#     parameters of the criterion, e.g. lambd
+#     the marginal condition is the model's get_marginal_func, so sperry, which
+#     has none, raises a ValueError
+#     returns the (n,3) values of get_optima_* and their (n,3,n_trait) gradient
+def get_optima_gradient(model, criterion, traits, drivers, step=1E-5, rtol=1E-8, **kwargs):
+    if criterion=="sperry":
+        raise ValueError("sperry has no marginal condition to differentiate")
+    drivers = get_driver_arrays(drivers)
+    n       = len(drivers["par"])
+    args    = [(drivers["d_leaf"][i], drivers["ca"][i], drivers["t_leaf"][i], drivers["par"][i]) for i in range(n)]
+    e_crit  = model.get_e_crit()
+    p_crit  = model.get_p_crit()
+    h_e     = 1E-6 * e_crit
+    # the optima, and the derivatives of the marginal (or the kink) and the
+    #     values with e
+    list_e  = zeros(n)
+    kinks   = zeros(n, dtype=bool)
+    values  = zeros((n,3))
+    df_de   = zeros(n)
+    dv_de   = zeros((n,3))
+    e_guess = None
+    for i in range(n):
+        marginal = model.get_marginal_func(criterion, e_crit, p_crit, *args[i], **kwargs)
+        def condition(e):
+            if kinks[i]:
+                return get_kink(model, e, *args[i])
+            return marginal(e)
+        e_opt     = model.solve_optima(marginal, e_crit, rtol, e_guess)
+        e_low     = max(e_opt-h_e, 0.0)
+        e_upp     = e_opt + h_e
+        list_e[i] = e_opt
+        kinks[i]  = 0<e_opt<e_crit and get_kink(model, e_low, *args[i]) * get_kink(model, e_upp, *args[i]) < 0
+        values[i] = model.get_optima_values(criterion, e_opt, *args[i])
+        df_de[i]  = (condition(e_upp) - condition(e_low)) / (e_upp-e_low)
+        dv_de[i]  = (array(model.get_optima_values(criterion, e_upp, *args[i])) -
+                     array(model.get_optima_values(criterion, e_low, *args[i]))) / (e_upp-e_low)
+        e_guess   = e_opt
+    # e_crit and the marginal (or the kink) and values at the fixed optima,
+    #     with each trait moved by -/+ its step
+    p,dp_de  = model.get_p_leaf(e_crit, True)
+    gradient = zeros((n,3,len(traits)))
+    for j,name in enumerate(traits):
+        trait = getattr(model, name)
+        h     = step * abs(trait) if trait!=0 else step
+        list_p_crit = []
+        list_p_leaf = []
+        for value in (trait-h, trait+h):
+            setattr(model, name, value)
+            list_p_crit.append(model.get_p_crit())
+            list_p_leaf.append(model.get_p_leaf(e_crit))
+        de_crit = ((list_p_crit[1]-list_p_crit[0]) - (list_p_leaf[1]-list_p_leaf[0])) / (2.0*h) / dp_de
+        list_f = zeros((2,n))
+        list_v = zeros((2,n,3))
+        for k,sign in enumerate((-1.0, 1.0)):
+            setattr(model, name, trait+sign*h)
+            e_crit_h = e_crit + sign*h*de_crit
+            p_crit_h = model.get_p_crit()
+            for i in range(n):
+                e_opt = e_crit_h if list_e[i]==e_crit else list_e[i]
+                if kinks[i]:
+                    list_f[k,i] = get_kink(model, e_opt, *args[i])
+                else:
+                    list_f[k,i] = model.get_marginal_func(criterion, e_crit_h, p_crit_h, *args[i], **kwargs)(e_opt)
+                list_v[k,i] = model.get_optima_values(criterion, e_opt, *args[i])
+        setattr(model, name, trait)
+        for i in range(n):
+            if list_e[i]==0:
+                de = 0.0
+            elif list_e[i]==e_crit:
+                de = de_crit
+            else:
+                de = -(list_f[1,i]-list_f[0,i]) / (2.0*h) / df_de[i]
+            # the values at the moved e_crit already include de_crit
+            if list_e[i]==e_crit:
+                gradient[i,:,j] = (list_v[1,i]-list_v[0,i]) / (2.0*h)
+            else:
+                gradient[i,:,j] = dv_de[i] * de + (list_v[1,i]-list_v[0,i]) / (2.0*h)
+    # the traits are back, and so is e_crit, from its old value as a guess
+    model.get_e_crit(e_crit)
+    return values, gradient
+
+# fit the traits in bounds, a dict of trait name and (lower, upper), to the
+#     observed e (the second value of get_optima_*, i.e. g*1.6 if output_g)
+#     and p_leaf of a series of drivers, by L-BFGS-B with the gradients of
+#     get_optima_gradient
+#     each of the observed series is a sum of squares relative to its own sum
+#     of squares, weighted by w_e or w_p; nan observations are skipped
+#     the traits are scaled to [0, 1] in bounds, and the model is left with the
+#     fitted traits; returns the scipy result with the fitted traits as x
+def calibrate_traits(model, criterion, bounds, drivers, e_obs=None, p_obs=None, w_e=1.0, w_p=1.0, step=1E-5, rtol=1E-8, maxiter=100, **kwargs):
+    names = list(bounds)
+    lower = array([bounds[name][0] for name in names], dtype=float)
+    upper = array([bounds[name][1] for name in names], dtype=float)
+    terms = []
+    for column,obs,weight in ((1,e_obs,w_e), (2,p_obs,w_p)):
+        if obs is not None:
+            obs  = array(obs, dtype=float)
+            mask = isfinite(obs)
+            terms.append( (column, obs, mask, weight / (obs[mask]**2).sum()) )
+    def set_traits(x):
+        for name,value in zip(names, lower + x*(upper-lower)):
+            setattr(model, name, value)
+    def objective(x):
+        set_traits(x)
+        values,gradient = get_optima_gradient(model, criterion, names, drivers, step, rtol, **kwargs)
+        loss = 0.0
+        jac  = zeros(len(names))
+        for column,obs,mask,scale in terms:
+            res   = values[mask,column] - obs[mask]
+            loss += scale * (res**2).sum()
+            jac  += 2.0 * scale * (res[:,None] * gradient[mask,column,:]).sum(axis=0)
+        return loss, jac * (upper-lower)
+    x0 = array([getattr(model, name) for name in names], dtype=float)
+    x0 = ((x0-lower) / (upper-lower)).clip(0.0, 1.0)
+    result = minimize(objective, x0, jac=True, method="L-BFGS-B", bounds=[(0.0,1.0)]*len(names), options={"maxiter": maxiter})
+    set_traits(result.x)
+    result.x = lower + result.x*(upper-lower)
+    return result
+
+
+
+
+if __name__ == "__main__":
+    from time  import perf_counter
+    from numpy import random
+    from gain_risk_model_aspen import gain_risk_model_aspen
+
+    # observations from known traits, fitted from traits 30% off
+    rng     = random.default_rng(0)
+    n       = 48
+    drivers = {"d_leaf": rng.uniform(0.5, 3.0, n),
+               "t_leaf": rng.uniform(15.0, 32.0, n),
+               "par"   : rng.uniform(200.0, 2000.0, n)}
+    truth   = {"k_stem": 4926.7, "b_stem": 3.12, "vmax": 61.74}
+    model   = gain_risk_model_aspen()
+    values,gradient = get_optima_gradient(model, "eller", list(truth), drivers)
+    for name,value in truth.items():
+        setattr(model, name, value*1.3)
+    bounds = {name: (0.5*value, 2.0*value) for name,value in truth.items()}
+    start  = perf_counter()
+    result = calibrate_traits(model, "eller", bounds, drivers, e_obs=values[:,1], p_obs=values[:,2])
+    print("%.2f s, %d evaluations, loss %.2e" % (perf_counter()-start, result.nfev, result.fun))
+    for name,value in zip(bounds, result.x):
+        print("%-8s fitted %10.4f true %10.4f" % (name, value, truth[name]))
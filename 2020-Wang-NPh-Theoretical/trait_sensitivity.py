@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+from copy            import deepcopy
+from multiprocessing import Pool
+from os.path         import exists,join
+
+from numpy             import isfinite,nan,zeros
+from numpy.lib.format  import open_memmap
+from pandas            import DataFrame
+from scipy.stats       import qmc
+
+from optima_series import get_model_hash,set_checkpoint
+
+OUTPUTS = ("a_opt", "e_opt", "p_opt")
+
+
+
+
+# samples of the traits in bounds, a dict of trait name and (lower, upper)
+#     method is "sobol" or "lhs", and the traits are drawn uniformly in bounds
+#     with saltelli, n base samples of the A and B matrices are drawn and the
+#     rows are ordered as A, B, then AB_i for each trait i (A with column i of
+#     B), n*(d+2) rows in total, as needed by get_sensitivity
+#     returns a dict of trait name and array of samples
+def get_samples(bounds, n, method="sobol", saltelli=True, seed=0):
+    names = list(bounds)
+    d     = len(names)
+    n_dim = 2*d if saltelli else d
+    if method=="sobol":
+        unit = qmc.Sobol(d=n_dim, scramble=True, seed=seed).random(n)
+    elif method=="lhs":
+        unit = qmc.LatinHypercube(d=n_dim, seed=seed).random(n)
+    else:
+        raise ValueError("method must be sobol or lhs, not %s" % method)
+    lower = [bounds[name][0] for name in names] * (n_dim//d)
+    upper = [bounds[name][1] for name in names] * (n_dim//d)
+    unit  = qmc.scale(unit, lower, upper)
+    if not saltelli:
+        return {name: unit[:,i] for i,name in enumerate(names)}
+    mat_a   = unit[:,:d]
+    mat_b   = unit[:,d:]
+    samples = zeros((n*(d+2),d))
+    samples[:n   ] = mat_a
+    samples[n:2*n] = mat_b
+    for i in range(d):
+        block = samples[(i+2)*n:(i+3)*n]
+        block[:]   = mat_a
+        block[:,i] = mat_b[:,i]
+    return {name: samples[:,i] for i,name in enumerate(names)}
+
+# first-order (saltelli 2010) and total (jansen 1999) sensitivity indices of
+#     y, the outputs of the n*(d+2) saltelli rows of get_samples
+#     base samples with a failed (nan) run in any of their rows are dropped
+def get_sensitivity(y, n, d):
+    blocks = y[:n*(d+2)].reshape(d+2, n)
+    blocks = blocks[:, isfinite(blocks).all(axis=0)]
+    y_a    = blocks[0]
+    y_b    = blocks[1]
+    var    = blocks[:2].var()
+    s1     = zeros(d)
+    st     = zeros(d)
+    for i in range(d):
+        y_ab  = blocks[i+2]
+        s1[i] = (y_b * (y_ab-y_a)).mean() / var
+        st[i] = 0.5 * ((y_a-y_ab)**2).mean() / var
+    return s1, st
+
+# optima of one chunk of trait samples, run in a worker process or in turn
+#     the traits are set on a copy of the model, so that they leak neither to
+#     other chunks nor to the model of the caller
+#     a sample that the optimizer fails on gives nan
+def get_sweep_chunk(task):
+    model,criterion,index,samples,kwargs = task
+    model  = deepcopy(model)
+    func   = getattr(model, "get_optima_"+criterion)
+    n      = len(next(iter(samples.values())))
+    result = zeros((n,3))
+    for i in range(n):
+        for name in samples:
+            setattr(model, name, samples[name][i])
+        try:
+            result[i] = func(**kwargs)
+        except (ValueError,ZeroDivisionError):
+            result[i] = nan
+    return index, result
+
+# open a column file in output, or create it if it is not there
+def get_column(output, name, n, dtype=float):
+    filename = join(output, name+".npy")
+    if exists(filename):
+        return open_memmap(filename, mode="r+")
+    return open_memmap(filename, mode="w+", dtype=dtype, shape=(n,))
+
+# trait sensitivity sweep of a criterion, kwargs go to the get_optima_* method
+#     e.g. the drivers d_leaf, ca, t_leaf and par
+#     the samples and the a_opt, e_opt and p_opt of each are written to one
+#     .npy column each in the output folder as the chunks finish, and a sweep
+#     that was stopped skips the chunks already done when called again with
+#     the same arguments and model traits
+#     returns a DataFrame of the first-order (s1) and total (st) indices of
+#     each output by trait, also saved as sensitivity.csv, or the columns as
+#     a dict if saltelli is False
+def run_sweep(model, criterion, bounds, n, output, method="sobol", saltelli=True, seed=0, processes=None, chunk_size=200, **kwargs):
+    samples = get_samples(bounds, n, method, saltelli, seed)
+    n_run   = len(next(iter(samples.values())))
+    n_chunk = (n_run + chunk_size - 1) // chunk_size
+    set_checkpoint(output, {"criterion" : criterion,
+                            "bounds"    : {name: list(bounds[name]) for name in bounds},
+                            "n"         : n,
+                            "method"    : method,
+                            "saltelli"  : saltelli,
+                            "seed"      : seed,
+                            "chunk_size": chunk_size,
+                            "kwargs"    : kwargs,
+                            "model"     : get_model_hash(model)})
+    columns = {}
+    for name in samples:
+        columns[name] = get_column(output, name, n_run)
+        columns[name][:] = samples[name]
+    for name in OUTPUTS:
+        columns[name] = get_column(output, name, n_run)
+    done = get_column(output, "done", n_chunk, dtype=bool)
+    # solve e_crit once here, so that the workers get it with the model
+    model.get_e_crit()
+    tasks = []
+    for index in range(n_chunk):
+        if not done[index]:
+            chunk = slice(index*chunk_size, (index+1)*chunk_size)
+            tasks.append( (model, criterion, index, {name: samples[name][chunk] for name in samples}, kwargs) )
+    def collect(index, result):
+        chunk = slice(index*chunk_size, (index+1)*chunk_size)
+        for i,name in enumerate(OUTPUTS):
+            columns[name][chunk] = result[:,i]
+            columns[name].flush()
+        done[index] = True
+        done.flush()
+    if processes==1 or len(tasks)<2:
+        for task in tasks:
+            collect(*get_sweep_chunk(task))
+    else:
+        with Pool(processes) as pool:
+            for index,result in pool.imap_unordered(get_sweep_chunk, tasks):
+                collect(index, result)
+    if not saltelli:
+        return columns
+    d     = len(bounds)
+    table = DataFrame(index=list(bounds))
+    table.index.name = "trait"
+    for name in OUTPUTS:
+        s1,st = get_sensitivity(columns[name], n, d)
+        table["s1_"+name] = s1
+        table["st_"+name] = st
+    table.to_csv(join(output, "sensitivity.csv"))
+    return table
+
+
+
+
+if __name__ == "__main__":
+    from tempfile import mkdtemp
+    from time     import perf_counter
+    from gain_risk_model_aspen import gain_risk_model_aspen
+
+    # +- 50% of the aspen traits
+    model  = gain_risk_model_aspen()
+    traits = ["k_root", "k_stem", "k_leaf", "b_stem", "c_stem", "vmax", "jmax", "laba", "p_soil"]
+    bounds = {name: (0.5*getattr(model,name), 1.5*getattr(model,name)) for name in traits}
+    start  = perf_counter()
+    table  = run_sweep(model, "wang", bounds, 256, mkdtemp(), chunk_size=100)
+    print("%d runs: %.2f s" % (256*(len(traits)+2), perf_counter()-start))
+    print(table)